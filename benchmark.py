@@ -0,0 +1,318 @@
+import argparse
+import array
+import itertools
+import json
+import random
+import sys
+import time
+import tracemalloc
+from suggestions import SuggestionEngine
+from vocabulary import Vocabulary
+
+
+# Measures how long the suggestion engine takes to respond to each keystroke.
+# Typing sessions are replayed against vocabularies of different sizes, either
+# generated at random or read from a file, and the latency percentiles and
+# memory used by the engine are reported.  A limit can be placed on the 99th
+# percentile so that a slow change fails a CI run.
+#
+# A session file has one JSON object per line.  Each object has a "field" and
+# either "text", which is typed one character at a time, or "keystrokes", a
+# list of the contents of the entry box after each keystroke.
+#
+#   python benchmark.py --sizes 10000 100000 1000000 --max-p99 5
+
+SYLLABLES = ['an', 'ber', 'cal', 'den', 'el', 'for', 'gan', 'har', 'is',
+             'jor', 'kin', 'lo', 'mar', 'ne', 'or', 'pe', 'qua', 'ros',
+             'st', 'ton', 'u', 'ver', 'wil', 'x', 'ya', 'zel']
+
+
+# Make a random word out of syllables
+def random_word(generator):
+    return ''.join(generator.choice(SYLLABLES)
+                   for _ in range(generator.randint(1, 4)))
+
+
+# Make a vocabulary of distinct attribute values.  Returns a list of
+# (attribute number, value, count) rows in descending order of count.  Counts
+# follow a Zipf distribution the way real attribute values tend to.
+def synthetic_vocabulary(size, fields=10, seed=0):
+    generator = random.Random(seed)
+    values = set()
+    while len(values) < size:
+        words = [random_word(generator)
+                 for _ in range(generator.randint(1, 3))]
+        if generator.random() < 0.2:
+            words.append(str(generator.randint(1, 9999)))
+        values.add(' '.join(words))
+    values = sorted(values)
+    generator.shuffle(values)
+    return [(generator.randrange(fields), value, max(1, 10000 // (rank + 1)))
+            for rank, value in enumerate(values)]
+
+
+# Make typing sessions by picking values, more common ones more often, and
+# typing each one until it is offered as a suggestion.  A fraction of the
+# sessions have two neighbouring letters swapped, as a typing mistake.
+def synthetic_sessions(vocabulary, number_of_sessions, seed=0,
+                       typo_rate=0.0):
+    generator = random.Random(seed)
+    rows = generator.choices(vocabulary,
+                             weights=[row[2] for row in vocabulary],
+                             k=number_of_sessions)
+    sessions = []
+    for field, value, _count in rows:
+        session = {'field': field, 'text': value}
+        if len(value) > 2 and generator.random() < typo_rate:
+            i = generator.randrange(0, len(value) - 1)
+            session['keystrokes'] = session_keystrokes(
+                {'text': value[0:i] + value[i + 1] + value[i] + value[i + 2:]})
+        sessions.append(session)
+    return sessions
+
+
+# Read typing sessions from a file of JSON lines
+def read_sessions(file_name):
+    sessions = []
+    with open(file_name, encoding='utf-8') as session_file:
+        for line in session_file:
+            line = line.strip()
+            if line:
+                sessions.append(json.loads(line))
+    return sessions
+
+
+# Return the contents of the entry box after each keystroke of a session
+def session_keystrokes(session):
+    if 'keystrokes' in session:
+        return session['keystrokes']
+    text = session['text']
+    return [text[0:length] for length in range(0, len(text) + 1)]
+
+
+# Return the value at a percentile of a sorted list
+def percentile(sorted_values, fraction):
+    if len(sorted_values) == 0:
+        return 0.0
+    position = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[position]
+
+
+# Build the engine and report the time taken and memory it holds
+def build_engine(vocabulary, measure_memory, fuzzy=False):
+    engine = SuggestionEngine(fuzzy=fuzzy)
+    if measure_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    engine.build(vocabulary)
+    build_seconds = time.perf_counter() - start
+    memory_bytes = None
+    if measure_memory:
+        memory_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    return engine, build_seconds, memory_bytes
+
+
+# Return the memory taken by the values of a vocabulary when they are held
+# the way SuggestionIndex used to hold them, as str objects in a list with a
+# dictionary to find their ids and a list of counts, and when they are held
+# in a Vocabulary with an array of counts
+def vocabulary_memory(vocabulary):
+    encoded = [value.encode('utf-8') for _field, value, _count in vocabulary]
+    counts = [count for _field, _value, count in vocabulary]
+
+    tracemalloc.start()
+    values = [value.decode('utf-8') for value in encoded]
+    ids = dict(zip(values, itertools.count()))
+    count_list = list(counts)
+    list_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del values, ids, count_list
+
+    tracemalloc.start()
+    compact = Vocabulary()
+    for value in encoded:
+        compact.add(value.decode('utf-8'))
+    count_array = array.array('q', counts)
+    compact_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del compact, count_array
+    return list_bytes, compact_bytes
+
+
+# Replay sessions and return the latency of every keystroke in seconds along
+# with the average number of keystrokes needed for the value to be suggested.
+# The text of a session is the value being typed, which may differ from the
+# keystrokes if there is a typing mistake.
+def replay(suggest, sessions):
+    latencies = []
+    keystrokes_needed = []
+    for session in sessions:
+        field = session.get('field')
+        target = session.get('text')
+        for count, text in enumerate(session_keystrokes(session)):
+            start = time.perf_counter()
+            suggestions = suggest(text, field)
+            latencies.append(time.perf_counter() - start)
+            if target is not None and target in suggestions:
+                keystrokes_needed.append(count)
+                break
+    average_keystrokes = None
+    if keystrokes_needed:
+        average_keystrokes = sum(keystrokes_needed) / len(keystrokes_needed)
+    return latencies, average_keystrokes
+
+
+# Replay sessions a step at a time, the way the data entry window runs the
+# search, and return how long each step took in seconds.  The longest step is
+# the longest that typing can be held up.
+def replay_steps(engine, sessions):
+    step_latencies = []
+    for session in sessions:
+        field = session.get('field')
+        for text in session_keystrokes(session):
+            steps = engine.suggest_steps(text, field)
+            while True:
+                start = time.perf_counter()
+                try:
+                    next(steps)
+                except StopIteration:
+                    break
+                finally:
+                    step_latencies.append(time.perf_counter() - start)
+    return step_latencies
+
+
+# Search the way the original refresh_suggestions did, by checking every
+# value in the vocabulary.  Used as a point of comparison.
+def linear_suggest_function(vocabulary):
+    ranked = [value for _field, value, _count in
+              sorted(vocabulary, key=lambda row: (-row[2], row[1]))]
+
+    def suggest(text, field):
+        words = text.split()
+        if len(words) == 0:
+            return ranked[0:3]
+        results = []
+        for value in ranked:
+            if all(word in value for word in words):
+                results.append(value)
+        return results[0:3]
+    return suggest
+
+
+# Benchmark one vocabulary size and return a dictionary of results
+def run_size(size, arguments):
+    vocabulary = synthetic_vocabulary(size, seed=arguments.seed)
+    if arguments.sessions:
+        sessions = read_sessions(arguments.sessions)
+    else:
+        sessions = synthetic_sessions(vocabulary,
+                                      arguments.number_of_sessions,
+                                      seed=arguments.seed,
+                                      typo_rate=arguments.typo_rate)
+
+    engine, build_seconds, memory_bytes = build_engine(vocabulary,
+                                                       arguments.memory,
+                                                       arguments.fuzzy)
+    latencies, average_keystrokes = replay(engine.suggest, sessions)
+    latencies.sort()
+    result = {'size': size,
+              'build_seconds': build_seconds,
+              'memory_bytes': memory_bytes,
+              'keystrokes': len(latencies),
+              'keystrokes_per_value': average_keystrokes,
+              'p50_ms': percentile(latencies, 0.50) * 1000,
+              'p95_ms': percentile(latencies, 0.95) * 1000,
+              'p99_ms': percentile(latencies, 0.99) * 1000,
+              'max_ms': latencies[-1] * 1000 if latencies else 0.0}
+
+    if arguments.memory:
+        result['vocabulary_list_bytes'], \
+            result['vocabulary_compact_bytes'] = vocabulary_memory(vocabulary)
+
+    if arguments.steps:
+        step_latencies = replay_steps(engine, sessions)
+        step_latencies.sort()
+        result['step_p99_ms'] = percentile(step_latencies, 0.99) * 1000
+        result['step_max_ms'] = step_latencies[-1] * 1000
+
+    if arguments.linear:
+        linear_latencies, _ = replay(linear_suggest_function(vocabulary),
+                                     sessions)
+        linear_latencies.sort()
+        result['linear_p50_ms'] = percentile(linear_latencies, 0.50) * 1000
+        result['linear_p99_ms'] = percentile(linear_latencies, 0.99) * 1000
+    return result
+
+
+# Print a result in a form that is easy to read
+def print_result(result):
+    print('vocabulary ' + str(result['size']))
+    print('  build          %10.2f s' % result['build_seconds'])
+    if result['memory_bytes'] is not None:
+        print('  memory         %10.1f MB' %
+              (result['memory_bytes'] / (1024 * 1024)))
+    if 'vocabulary_list_bytes' in result:
+        print('  values as list %10.1f MB' %
+              (result['vocabulary_list_bytes'] / (1024 * 1024)))
+        print('  values compact %10.1f MB' %
+              (result['vocabulary_compact_bytes'] / (1024 * 1024)))
+    print('  keystrokes     %10d' % result['keystrokes'])
+    if result['keystrokes_per_value'] is not None:
+        print('  per value      %10.2f' % result['keystrokes_per_value'])
+    for name in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms',
+                 'step_p99_ms', 'step_max_ms',
+                 'linear_p50_ms', 'linear_p99_ms'):
+        if name in result:
+            print('  %-14s %10.3f ms' % (name[0:-3], result[name]))
+
+
+def main(argument_list=None):
+    parser = argparse.ArgumentParser(
+        description="Replay typing sessions against the suggestion engine")
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000],
+                        help="vocabulary sizes to test")
+    parser.add_argument('--sessions',
+                        help="file of recorded sessions, one JSON per line")
+    parser.add_argument('--number-of-sessions', type=int, default=500,
+                        help="number of synthetic sessions to replay")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--typo-rate', type=float, default=0.0,
+                        help="fraction of synthetic sessions with a typo")
+    parser.add_argument('--fuzzy', action='store_true',
+                        help="turn on fuzzy matching")
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help="don't measure memory, which slows the build")
+    parser.add_argument('--steps', action='store_true',
+                        help="also time each step of the search, which is "
+                             "how long typing can be held up")
+    parser.add_argument('--linear', action='store_true',
+                        help="also time the original linear search")
+    parser.add_argument('--json', action='store_true',
+                        help="print the results as JSON")
+    parser.add_argument('--max-p99', type=float, default=None,
+                        help="fail if the 99th percentile is above this "
+                             "many milliseconds")
+    arguments = parser.parse_args(argument_list)
+
+    results = [run_size(size, arguments) for size in arguments.sizes]
+    if arguments.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print_result(result)
+
+    if arguments.max_p99 is not None:
+        for result in results:
+            if result['p99_ms'] > arguments.max_p99:
+                print('p99 latency ' + str(result['p99_ms']) +
+                      ' ms for vocabulary ' + str(result['size']) +
+                      ' is above the limit of ' + str(arguments.max_p99) +
+                      ' ms', file=sys.stderr)
+                return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from index_snapshot import pause_change_counter, resume_change_counter
+
+
+# File names given to the made up records created from seed vocabularies.
+# They are never in the list of images so they are never shown, but their
+# values are counted when suggestions are made.
+SEED_PREFIX = '__seed__/'
+
+
+# Counts rows as they are transferred and reports the rate every so often
+class Throughput:
+    def __init__(self, description, report_every=1000000, stream=sys.stderr):
+        self.description = description
+        self.report_every = report_every
+        self.stream = stream
+        self.rows = 0
+        self.start = time.perf_counter()
+        self.next_report = report_every
+
+    def add(self, rows):
+        self.rows += rows
+        if self.stream is not None and self.rows >= self.next_report:
+            self.report()
+            self.next_report += self.report_every
+
+    def report(self):
+        seconds = time.perf_counter() - self.start
+        rate = self.rows / seconds if seconds > 0 else 0.0
+        print('%s %d rows in %.1f s (%.0f rows/s)' %
+              (self.description, self.rows, seconds, rate),
+              file=self.stream)
+
+
+# Work out the format of a file from its extension
+def guess_format(file_name):
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension in ('.jsonl', '.json', '.ndjson'):
+        return 'jsonl'
+    if extension == '.txt':
+        return 'text'
+    return 'csv'
+
+
+# Open a file for reading or writing as text.  '-' means standard input or
+# output, which are left open when the file is closed.
+def open_text(file_name, mode):
+    if file_name == '-':
+        stream = sys.stdin if mode == 'r' else sys.stdout
+        stream.flush()
+        return open(stream.fileno(), mode, encoding='utf-8', newline='',
+                    closefd=False)
+    return open(file_name, mode, encoding='utf-8', newline='')
+
+
+# Turn a row of results into (file name, attribute number, attribute) rows.
+# A row either holds a single attribute in FILE_NAME, ATTRIBUTE_NUMBER and
+# ATTRIBUTE, or holds a whole record as FILE_NAME followed by a column for
+# each attribute named after its number, the way results are exported.
+def result_rows(row):
+    file_name = row['FILE_NAME']
+    if 'ATTRIBUTE_NUMBER' in row:
+        yield file_name, int(row['ATTRIBUTE_NUMBER']), row.get('ATTRIBUTE')
+        return
+    attributes = row.get('ATTRIBUTES')
+    if attributes is not None:
+        for attribute_number, attribute in enumerate(attributes):
+            if attribute is not None:
+                yield file_name, attribute_number, attribute
+        return
+    for column, attribute in row.items():
+        if column != 'FILE_NAME' and attribute is not None:
+            yield file_name, int(column), attribute
+
+
+# Turn a row of a seed vocabulary into made up results.  A row has an
+# ATTRIBUTE, and can have the ATTRIBUTE_NUMBER it belongs to and a COUNT of
+# how many times it should be counted.  The made up file names include the
+# name of the seed file, so importing the same file again replaces its
+# records rather than adding to them.
+def seed_rows(row, seed_name, row_number):
+    attribute_number = int(row.get('ATTRIBUTE_NUMBER') or 0)
+    count = int(row.get('COUNT') or 1)
+    for copy in range(0, count):
+        file_name = ''.join(SEED_PREFIX + seed_name + '/' +
+                            str(row_number) + '/' + str(copy))
+        yield file_name, attribute_number, row['ATTRIBUTE']
+
+
+# Read the rows of a file as dictionaries
+def read_rows(stream, file_format):
+    if file_format == 'jsonl':
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    elif file_format == 'text':
+        for line in stream:
+            line = line.rstrip('\r\n')
+            if line:
+                yield {'ATTRIBUTE': line}
+    else:
+        for row in csv.DictReader(stream):
+            yield dict((column, value) for column, value in row.items()
+                       if value != '' or column == 'ATTRIBUTE')
+
+
+# Load results or a seed vocabulary from a file into the RESULTS table.  Rows
+# are inserted in batches with executemany and the whole import is a single
+# transaction, so a failed import leaves the table as it was.  Returns the
+# number of rows written.
+def import_results(db_connection, file_name, file_format=None, seed=False,
+                   batch_size=50000, report_stream=sys.stderr):
+    if file_format is None:
+        file_format = guess_format(file_name)
+    throughput = Throughput('imported', stream=report_stream)
+
+    with open_text(file_name, 'r') as stream:
+        rows = read_rows(stream, file_format)
+        if seed:
+            seed_name = os.path.basename(file_name)
+            results = itertools.chain.from_iterable(
+                seed_rows(row, seed_name, row_number)
+                for row_number, row in enumerate(rows))
+        else:
+            results = itertools.chain.from_iterable(
+                result_rows(row) for row in rows)
+
+        db_connection.commit()
+        db_connection.execute('BEGIN IMMEDIATE')
+        try:
+            pause_change_counter(db_connection)
+            while True:
+                batch = list(itertools.islice(results, batch_size))
+                if len(batch) == 0:
+                    break
+                db_connection.executemany(
+                    "INSERT OR REPLACE INTO RESULTS values (?, ?, ?)", batch)
+                throughput.add(len(batch))
+            resume_change_counter(db_connection)
+            db_connection.commit()
+        except BaseException:
+            db_connection.rollback()
+            raise
+
+    if report_stream is not None:
+        throughput.report()
+    return throughput.rows
+
+
+# Write the RESULTS table to a file with one row for each file name and a
+# column for each attribute.  Rows are read from the database in primary key
+# order and grouped as they arrive, so memory use doesn't grow with the size
+# of the table.  Made up seed records are left out unless include_seed is
+# set.  Returns the number of records written.
+#
+# Results can only be written as CSV or JSON lines.  A text file only holds
+# a list of values, so asking for one raises ValueError before anything is
+# written.
+def export_results(db_connection, file_name, file_format=None,
+                   include_seed=False, report_stream=sys.stderr):
+    if file_format is None:
+        file_format = guess_format(file_name)
+    if file_format not in ('csv', 'jsonl'):
+        raise ValueError("results can only be exported as CSV or JSON "
+                         "lines, not " + file_format)
+    throughput = Throughput('exported', stream=report_stream)
+
+    row = db_connection.execute(
+        'SELECT MAX(ATTRIBUTE_NUMBER) from RESULTS').fetchone()
+    number_of_attributes = 0 if row[0] is None else row[0] + 1
+
+    cursor = db_connection.execute(
+        '''SELECT FILE_NAME, ATTRIBUTE_NUMBER, ATTRIBUTE from RESULTS
+        where ? OR substr(FILE_NAME, 1, ?) != ?
+        ORDER BY FILE_NAME, ATTRIBUTE_NUMBER''',
+        (1 if include_seed else 0, len(SEED_PREFIX), SEED_PREFIX))
+
+    with open_text(file_name, 'w') as stream:
+        writer = None
+        if file_format == 'csv':
+            writer = csv.writer(stream)
+            writer.writerow(['FILE_NAME'] +
+                            [str(i) for i in range(0, number_of_attributes)])
+
+        for record_name, attributes in itertools.groupby(
+                cursor, key=lambda result: result[0]):
+            values = [None] * number_of_attributes
+            for _file_name, attribute_number, attribute in attributes:
+                if 0 <= attribute_number < number_of_attributes:
+                    values[attribute_number] = attribute
+            if writer is not None:
+                writer.writerow([record_name] +
+                                ['' if value is None else value
+                                 for value in values])
+            else:
+                stream.write(json.dumps({'FILE_NAME': record_name,
+                                         'ATTRIBUTES': values}) + '\n')
+            throughput.add(1)
+
+    if report_stream is not None:
+        throughput.report()
+    return throughput.rows
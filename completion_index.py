@@ -0,0 +1,90 @@
+# Keeps count of how many fields of each record hold a value, so records
+# that still need work can be found without reading them.  The COMPLETION
+# table has a row for every record in the manifest with the number of
+# fields filled in and whether that is all of them.  It is indexed on
+# (COMPLETE, RECORD_NUMBER), so the nearest incomplete record either side of
+# any record is found with a single index lookup however many records there
+# are.
+#
+# The count for a record is written in the same transaction that saves it.
+# Results loaded in bulk are counted afterwards with recount().
+class CompletionIndex:
+    def __init__(self, db_connection, number_of_fields):
+        self.db_connection = db_connection
+        self.number_of_fields = number_of_fields
+
+        self.db_connection.execute('''CREATE TABLE IF NOT EXISTS COMPLETION
+        (RECORD_NUMBER INTEGER PRIMARY KEY,
+        FILLED INT NOT NULL,
+        COMPLETE INT NOT NULL
+        );''')
+        self.db_connection.execute('''CREATE INDEX IF NOT EXISTS
+        COMPLETION_STATUS on COMPLETION (COMPLETE, RECORD_NUMBER);''')
+        self.db_connection.commit()
+
+    # Return the SQL that counts the values stored for the records in the
+    # manifest that match a condition
+    def count_query(self, condition):
+        return '''SELECT RECORD_NUMBER, FILLED, FILLED >= ? from
+        (SELECT MANIFEST.RECORD_NUMBER AS RECORD_NUMBER,
+        (SELECT COUNT(*) from RESULTS
+        where RESULTS.FILE_NAME = MANIFEST.FILE_NAME AND
+        RESULTS.ATTRIBUTE_NUMBER < ? AND
+        RESULTS.ATTRIBUTE IS NOT NULL AND RESULTS.ATTRIBUTE != '') AS FILLED
+        from MANIFEST where ''' + condition + ')'
+
+    # Add rows for records that have joined the manifest since the last
+    # call, counting any values that are already stored for them.  Record
+    # numbers only ever grow, so these are the records after the last row.
+    # Returns the number of rows added.
+    def add_new_records(self):
+        cursor = self.db_connection.execute(
+            'INSERT INTO COMPLETION ' + self.count_query(
+                '''MANIFEST.RECORD_NUMBER >
+                (SELECT IFNULL(MAX(RECORD_NUMBER), -1) from COMPLETION)'''),
+            (self.number_of_fields, self.number_of_fields))
+        self.db_connection.commit()
+        return cursor.rowcount
+
+    # Count the values of every record again
+    def recount(self):
+        self.db_connection.execute(
+            'INSERT OR REPLACE INTO COMPLETION ' + self.count_query('1'),
+            (self.number_of_fields, self.number_of_fields))
+        self.db_connection.commit()
+
+    # Return the SQL that records how many fields of a record have values.
+    # It is run in the same transaction that saves the record.
+    def update_statement(self, record_number, values):
+        filled = sum(1 for value in values[0:self.number_of_fields] if value)
+        return ('INSERT OR REPLACE INTO COMPLETION values (?, ?, ?)',
+                (record_number, filled,
+                 1 if filled >= self.number_of_fields else 0))
+
+    # Return the number of fields of a record that have values
+    def filled(self, record_number):
+        row = self.db_connection.execute(
+            'SELECT FILLED from COMPLETION where RECORD_NUMBER=?',
+            (record_number,)).fetchone()
+        return 0 if row is None else row[0]
+
+    # Return the first incomplete record after start, or before it if
+    # direction is negative.  The search wraps around the end of the
+    # records but never returns start itself.  Returns None if every other
+    # record is complete.
+    def find_incomplete(self, start, direction):
+        if direction >= 0:
+            searches = (('RECORD_NUMBER > ?', start, 'ASC'),
+                        ('RECORD_NUMBER < ?', start, 'ASC'))
+        else:
+            searches = (('RECORD_NUMBER < ?', start, 'DESC'),
+                        ('RECORD_NUMBER > ?', start, 'DESC'))
+        for condition, value, order in searches:
+            row = self.db_connection.execute(
+                '''SELECT RECORD_NUMBER from COMPLETION
+                where COMPLETE = 0 AND ''' + condition + '''
+                ORDER BY RECORD_NUMBER ''' + order + ' LIMIT 1',
+                (value,)).fetchone()
+            if row is not None:
+                return row[0]
+        return None
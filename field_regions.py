@@ -0,0 +1,39 @@
+# The part of the image that each entry box's value is read from, kept in
+# the FIELD_REGIONS table so the image can be zoomed to it when the box is
+# entered.  Regions are stored as fractions of the width and height of the
+# image so one region suits every scan of the same form.  There are only a
+# few, so they are all read when the program starts.
+class FieldRegions:
+    def __init__(self, db_connection):
+        self.db_connection = db_connection
+
+        self.db_connection.execute('''CREATE TABLE IF NOT EXISTS FIELD_REGIONS
+        (ATTRIBUTE_NUMBER INTEGER PRIMARY KEY,
+        LEFT_EDGE REAL NOT NULL,
+        TOP_EDGE REAL NOT NULL,
+        RIGHT_EDGE REAL NOT NULL,
+        BOTTOM_EDGE REAL NOT NULL
+        );''')
+        self.db_connection.commit()
+        self.regions = dict(
+            (row[0], tuple(row[1:])) for row in self.db_connection.execute(
+                '''SELECT ATTRIBUTE_NUMBER, LEFT_EDGE, TOP_EDGE, RIGHT_EDGE,
+                BOTTOM_EDGE from FIELD_REGIONS'''))
+
+    # Return the region of a field as (left, top, right, bottom), or None if
+    # it doesn't have one
+    def get(self, field):
+        return self.regions.get(field)
+
+    # Save the region of a field.  A region of None removes it.
+    def set(self, field, region):
+        if region is None:
+            self.regions.pop(field, None)
+            self.db_connection.execute(
+                'DELETE from FIELD_REGIONS where ATTRIBUTE_NUMBER=?', (field,))
+        else:
+            self.regions[field] = tuple(region)
+            self.db_connection.execute(
+                'INSERT OR REPLACE INTO FIELD_REGIONS values (?, ?, ?, ?, ?)',
+                (field,) + tuple(region))
+        self.db_connection.commit()
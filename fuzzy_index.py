@@ -0,0 +1,123 @@
+from collections import defaultdict
+from stepwise import run_steps
+
+
+# Return the edit distance between two strings counting insertions,
+# deletions, substitutions and swaps of neighbouring characters, or
+# max_distance + 1 if it is more than max_distance
+def edit_distance(first, second, max_distance):
+    if abs(len(first) - len(second)) > max_distance:
+        return max_distance + 1
+    previous_previous = None
+    previous = list(range(0, len(second) + 1))
+    for i in range(1, len(first) + 1):
+        current = [i] + [0] * len(second)
+        row_minimum = i
+        for j in range(1, len(second) + 1):
+            cost = 0 if first[i - 1] == second[j - 1] else 1
+            distance = min(previous[j] + 1,
+                           current[j - 1] + 1,
+                           previous[j - 1] + cost)
+            if i > 1 and j > 1 and first[i - 1] == second[j - 2] and \
+                    first[i - 2] == second[j - 1]:
+                distance = min(distance, previous_previous[j - 2] + 1)
+            current[j] = distance
+            if distance < row_minimum:
+                row_minimum = distance
+        if row_minimum > max_distance:
+            return max_distance + 1
+        previous_previous = previous
+        previous = current
+    distance = previous[len(second)]
+    return distance if distance <= max_distance else max_distance + 1
+
+
+# Finds the words in a vocabulary that are within a small edit distance of a
+# word that may have been mistyped, using the symmetric delete method
+# (SymSpell).  Every string that can be made by deleting up to max_distance
+# characters from the start of a word is stored with the word it came from.
+# A lookup makes the same deletions from the typed word, so the words close
+# to it are found with dictionary lookups instead of comparing it with every
+# word.  Only the first prefix_length characters are used to make deletions,
+# which keeps the index small, and candidates are checked with the full edit
+# distance.
+#
+# Each word has a count.  A word whose count drops to zero stays in the index
+# but isn't returned.
+#
+# Working out an edit distance is slow, so a lookup written as steps pauses
+# after every step_size candidates.
+class SymSpellIndex:
+    def __init__(self, max_distance=2, prefix_length=7, step_size=10):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.step_size = step_size
+        self.words = []
+        self.ids = {}
+        self.counts = []
+        self.deletes = defaultdict(list)
+
+    def __len__(self):
+        return len(self.words)
+
+    # Change the count of a word by delta, adding it if it is new
+    def add(self, word, delta=1):
+        word_id = self.ids.get(word)
+        if word_id is None:
+            if delta <= 0:
+                return
+            word_id = len(self.words)
+            self.words.append(word)
+            self.ids[word] = word_id
+            self.counts.append(0)
+            for variant in self.delete_variants(word[0:self.prefix_length]):
+                self.deletes[variant].append(word_id)
+        self.counts[word_id] = max(self.counts[word_id] + delta, 0)
+
+    # Return every string made by deleting up to max_distance characters
+    def delete_variants(self, word):
+        variants = {word}
+        edge = {word}
+        for _distance in range(0, self.max_distance):
+            next_edge = set()
+            for variant in edge:
+                for i in range(0, len(variant)):
+                    deleted = variant[0:i] + variant[i + 1:]
+                    if deleted not in variants:
+                        variants.add(deleted)
+                        next_edge.add(deleted)
+            edge = next_edge
+        return variants
+
+    # Return the words within max_distance of a word as (word, distance)
+    # pairs, closest and then most common first
+    def lookup(self, word, max_distance=None):
+        return run_steps(self.lookup_steps(word, max_distance))
+
+    # The same lookup, written as steps that can be run a slice at a time
+    def lookup_steps(self, word, max_distance=None):
+        if max_distance is None:
+            max_distance = self.max_distance
+        max_distance = min(max_distance, self.max_distance)
+        prefix = word[0:self.prefix_length]
+
+        candidates = set()
+        for variant in self.delete_variants(prefix):
+            if len(prefix) - len(variant) > max_distance:
+                continue
+            candidates.update(self.deletes.get(variant, ()))
+            yield None
+
+        results = []
+        for checked, word_id in enumerate(candidates):
+            if checked % self.step_size == self.step_size - 1:
+                yield None
+            if self.counts[word_id] == 0:
+                continue
+            distance = edit_distance(word, self.words[word_id], max_distance)
+            if distance <= max_distance:
+                results.append((distance, -self.counts[word_id],
+                                self.words[word_id]))
+        results.sort()
+        return [(candidate, distance)
+                for distance, _count, candidate in results]
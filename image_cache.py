@@ -0,0 +1,222 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+# Pillow refuses to open images over twice its MAX_IMAGE_PIXELS, about 179
+# megapixels by default, to guard against decompression bombs.  Large
+# format scans can be bigger than that, so allow up to a gigapixel.  Images
+# beyond this are reported as unreadable.
+MAX_IMAGE_PIXELS = 500000000
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+
+# Work out the size an image should be scaled to so that it fits in a frame.
+# If the aspect ratio is locked the image keeps its shape, otherwise it is
+# stretched to fill the frame.
+def fit_size(image_size, frame_size, aspect_locked=True):
+    image_width, image_height = image_size
+    frame_width, frame_height = frame_size
+    if not aspect_locked:
+        return frame_width, frame_height
+    width_ratio = image_width / frame_width
+    height_ratio = image_height / frame_height
+    resize_ratio = max(width_ratio, height_ratio)
+    return int(image_width / resize_ratio), int(image_height / resize_ratio)
+
+
+# Rough number of bytes used by a decoded image
+def image_bytes(image):
+    if image is None:
+        return 0
+    width, height = image.size
+    return width * height * len(image.getbands())
+
+
+# A decoded image along with a copy that has been scaled to fit a frame.
+# scaled is None if the frame size wasn't known when the image was loaded.
+# The decoded image may be a reduced copy of the original if it came from an
+# image pyramid.
+class CachedImage:
+    def __init__(self, image, scaled=None, frame_size=None,
+                 original_size=None):
+        self.image = image
+        self.scaled = scaled
+        self.frame_size = frame_size
+        self.original_size = original_size or image.size
+        self.size_in_bytes = image_bytes(image) + image_bytes(scaled)
+
+    # Return the scaled image if it was made for a frame of this size
+    def scaled_for(self, frame_size):
+        if self.frame_size == frame_size:
+            return self.scaled
+        return None
+
+    # Return True if the decoded image has too few pixels to fill a frame
+    def too_small_for(self, frame_size, aspect_locked=True):
+        if self.image.size == self.original_size:
+            return False
+        width, height = fit_size(self.original_size, frame_size, aspect_locked)
+        return width > self.image.size[0] or height > self.image.size[1]
+
+
+# Open and decode an image.  If a frame size is given a high quality copy is
+# also made that fits the frame, and if there is an image pyramid it is used
+# to avoid decoding the original at full size.  The pyramid is built first if
+# build_missing is set, otherwise the original is decoded if the pyramid
+# isn't there yet.  Usually runs on a worker thread.
+def load_image(path, frame_size=None, aspect_locked=True, pyramid=None,
+               build_missing=True):
+    frame_known = frame_size is not None and min(frame_size) > 1
+    if pyramid is not None and frame_known:
+        image, original_size = pyramid.open(path, frame_size, aspect_locked,
+                                            build_missing)
+    else:
+        image = Image.open(path)
+        image.load()
+        original_size = image.size
+    scaled = None
+    if frame_known:
+        scaled = image.resize(fit_size(image.size, frame_size, aspect_locked),
+                              Image.LANCZOS)
+    return CachedImage(image, scaled, frame_size, original_size)
+
+
+# Build the pyramid of an image if it isn't there.  Run on a worker thread,
+# where there is nobody to tell if the file can't be read, so errors are
+# ignored.  They are reported when the image is shown.
+def build_quietly(pyramid, path):
+    try:
+        if not pyramid.is_built(path):
+            pyramid.build(path)
+    except Exception:
+        pass
+
+
+# A least recently used cache of decoded images limited by the amount of
+# memory the images take up.  It can be used from several threads.
+class ImageCache:
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, path):
+        with self.lock:
+            return path in self.entries
+
+    # Return the cached image for a path, or None if it isn't cached
+    def get(self, path):
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(path)
+            return entry
+
+    # Add an image to the cache, evicting the least recently used images
+    # until it fits.  An image bigger than the whole cache is not kept.
+    def put(self, path, entry):
+        with self.lock:
+            old_entry = self.entries.pop(path, None)
+            if old_entry is not None:
+                self.current_bytes -= old_entry.size_in_bytes
+            if entry.size_in_bytes > self.max_bytes:
+                return
+            while self.current_bytes + entry.size_in_bytes > self.max_bytes:
+                _path, evicted = self.entries.popitem(last=False)
+                self.current_bytes -= evicted.size_in_bytes
+                self.evictions += 1
+            self.entries[path] = entry
+            self.current_bytes += entry.size_in_bytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+    # Return a dictionary describing how well the cache is working
+    def statistics(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'images': len(self.entries),
+                    'bytes': self.current_bytes,
+                    'max_bytes': self.max_bytes}
+
+
+# Decodes images on a pool of worker threads ahead of when they are needed
+# and keeps them in an ImageCache.  Pillow releases the interpreter lock while
+# decoding and resizing so the Tk thread stays responsive.  Images are read
+# through an ImagePyramid if one is given.
+class ImagePrefetcher:
+    def __init__(self, cache=None, workers=2, pyramid=None):
+        self.cache = cache if cache is not None else ImageCache()
+        self.pyramid = pyramid
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    # Start loading images that aren't already cached or being loaded
+    def prefetch(self, paths, frame_size=None, aspect_locked=True):
+        for path in paths:
+            with self.lock:
+                if path in self.pending or path in self.cache:
+                    continue
+                future = self.executor.submit(load_image, path, frame_size,
+                                              aspect_locked, self.pyramid)
+                self.pending[path] = future
+            future.add_done_callback(
+                lambda done, path=path: self.loaded(path, done))
+
+    # Move a finished image into the cache.  Images that could not be
+    # decoded are left out so that the error is reported when they are shown.
+    def loaded(self, path, future):
+        with self.lock:
+            if self.pending.get(path) is future:
+                del self.pending[path]
+        if not future.cancelled() and future.exception() is None:
+            self.cache.put(path, future.result())
+
+    # Return a decoded image.  If it is being prefetched wait for it,
+    # otherwise load it straight away.  Raises OSError if the file isn't an
+    # image.
+    def get(self, path, frame_size=None, aspect_locked=True):
+        entry = self.cache.get(path)
+        if entry is not None:
+            return entry
+        with self.lock:
+            future = self.pending.get(path)
+        if future is not None:
+            return future.result()
+        return self.reload(path, frame_size, aspect_locked)
+
+    # Load an image straight away, replacing any cached copy.  Used when the
+    # cached copy is too small for the frame.  This runs on the Tk thread, so
+    # a missing pyramid isn't built here.  The original is decoded instead
+    # and the pyramid is built on a worker thread for next time.
+    def reload(self, path, frame_size=None, aspect_locked=True):
+        entry = load_image(path, frame_size, aspect_locked, self.pyramid,
+                           build_missing=False)
+        self.cache.put(path, entry)
+        if self.pyramid is not None:
+            self.executor.submit(build_quietly, self.pyramid, path)
+        return entry
+
+    # Cancel outstanding work and stop the worker threads
+    def close(self):
+        with self.lock:
+            futures = list(self.pending.values())
+            self.pending.clear()
+        for future in futures:
+            future.cancel()
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,180 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+
+# A difference hash is worked out from a greyscale copy of the image shrunk
+# to HASH_SIZE + 1 by HASH_SIZE pixels.  Each bit says whether a pixel is
+# brighter than the one to its right, so the hash stays the same when an
+# image is scanned again at a different size, brightness or quality.
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+
+# The hash is split into this many bands for searching.  Two hashes that are
+# fewer than NUMBER_OF_BANDS bits apart must have at least one band exactly
+# the same, so only images that share a band need to be compared.
+NUMBER_OF_BANDS = 4
+BAND_BITS = HASH_BITS // NUMBER_OF_BANDS
+MAX_DISTANCE = NUMBER_OF_BANDS - 1
+
+
+# Return the difference hash of an image as a number
+def difference_hash(image):
+    size = (HASH_SIZE + 1, HASH_SIZE)
+    image.draft('L', (size[0] * 4, size[1] * 4))
+    pixels = list(image.convert('L').resize(size, Image.BOX).getdata())
+    value = 0
+    for row in range(0, HASH_SIZE):
+        for column in range(0, HASH_SIZE):
+            left = pixels[row * size[0] + column]
+            value = (value << 1) | (left > pixels[row * size[0] + column + 1])
+    return value
+
+
+# Hash one file.  Used by the worker processes in ImageHashes.update so must
+# be at module level.  Returns None if the file isn't an image or can't be
+# decoded.  Pillow raises all sorts of errors for damaged or huge files, such
+# as DecompressionBombError, and one bad file mustn't stop the rest.
+def hash_file(path):
+    try:
+        return difference_hash(Image.open(path))
+    except Exception:
+        return None
+
+
+# Return the bands of a hash, most significant first
+def hash_bands(value):
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (BAND_BITS * band)) & mask
+            for band in range(NUMBER_OF_BANDS - 1, -1, -1)]
+
+
+# SQLite integers are signed, so hashes with the top bit set are stored as
+# negative numbers
+def to_signed(value):
+    return value - (1 << HASH_BITS) if value >> (HASH_BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value & ((1 << HASH_BITS) - 1)
+
+
+# Return the number of bits that are different between two hashes.  It is
+# also used as an SQL function on the stored hashes, which may be negative.
+def hamming_distance(first, second):
+    return bin((first ^ second) & ((1 << HASH_BITS) - 1)).count('1')
+
+
+# The hashes of every image, kept in the IMAGE_HASHES table so near duplicate
+# scans can be found.  Each band of a hash has its own index, so finding the
+# images within MAX_DISTANCE bits of another is a handful of index lookups
+# followed by checking the few images that share a band.
+#
+# The modification time and size of each file are stored with its hash and
+# only files where they have changed are hashed again.  Files that aren't
+# images are stored without a hash so they aren't tried again either.
+# Hashes are committed batch_size at a time, so an interrupted run keeps
+# most of its work and other programs aren't locked out of the database
+# while it runs.
+class ImageHashes:
+    def __init__(self, db_connection, batch_size=1000):
+        self.db_connection = db_connection
+        self.batch_size = batch_size
+        self.db_connection.create_function('HAMMING_DISTANCE', 2,
+                                           hamming_distance)
+
+        band_columns = ''.join(',\nBAND' + str(band) + ' INT'
+                               for band in range(0, NUMBER_OF_BANDS))
+        self.db_connection.execute('''CREATE TABLE IF NOT EXISTS IMAGE_HASHES
+        (FILE_NAME TEXT PRIMARY KEY,
+        MODIFIED INT NOT NULL,
+        SIZE INT NOT NULL,
+        HASH INT''' + band_columns + '''
+        );''')
+        for band in range(0, NUMBER_OF_BANDS):
+            self.db_connection.execute(
+                '''CREATE INDEX IF NOT EXISTS IMAGE_HASHES_BAND%d
+                on IMAGE_HASHES (BAND%d);''' % (band, band))
+        self.db_connection.commit()
+
+    # Hash the files in a directory that are new or have changed since they
+    # were last hashed, on a pool of processes.  Returns the number of files
+    # hashed, unchanged and that couldn't be read.
+    def update(self, directory_name, file_names, workers=None):
+        known = dict((row[0], (row[1], row[2]))
+                     for row in self.db_connection.execute(
+                         'SELECT FILE_NAME, MODIFIED, SIZE from IMAGE_HASHES'))
+
+        changed = []
+        hashed = 0
+        unchanged = 0
+        failed = 0
+        for file_name in file_names:
+            try:
+                status = os.stat(os.path.join(directory_name, file_name))
+            except OSError:
+                failed += 1
+                continue
+            key = (status.st_mtime_ns, status.st_size)
+            if known.get(file_name) == key:
+                unchanged += 1
+            else:
+                changed.append((file_name, key))
+
+        paths = [os.path.join(directory_name, file_name)
+                 for file_name, key in changed]
+        rows = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for (file_name, key), value in zip(
+                    changed, executor.map(hash_file, paths, chunksize=16)):
+                if value is None:
+                    failed += 1
+                    rows.append((file_name, key[0], key[1], None) +
+                                (None,) * NUMBER_OF_BANDS)
+                else:
+                    hashed += 1
+                    rows.append((file_name, key[0], key[1],
+                                 to_signed(value)) +
+                                tuple(hash_bands(value)))
+                if len(rows) >= self.batch_size:
+                    self.write_rows(rows)
+                    rows = []
+        self.write_rows(rows)
+        return hashed, unchanged, failed
+
+    # Store a batch of hashes
+    def write_rows(self, rows):
+        self.db_connection.executemany(
+            'INSERT OR REPLACE INTO IMAGE_HASHES values (' +
+            ', '.join('?' * (4 + NUMBER_OF_BANDS)) + ')', rows)
+        self.db_connection.commit()
+
+    # Return the hash of a file, or None if it hasn't been hashed
+    def file_hash(self, file_name):
+        row = self.db_connection.execute(
+            'SELECT HASH from IMAGE_HASHES where FILE_NAME=?',
+            (file_name,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return to_unsigned(row[0])
+
+    # Return up to limit other files whose images are within max_distance
+    # bits of a file's, as a list of (distance, file name) with the closest
+    # first.  The distances are worked out and sorted by SQLite, so a hash
+    # shared by a great many images, such as that of a blank page, doesn't
+    # fill a list with all of them.
+    def similar(self, file_name, max_distance=MAX_DISTANCE, limit=20):
+        value = self.file_hash(file_name)
+        if value is None:
+            return []
+        condition = ' OR '.join('BAND' + str(band) + '=?'
+                                for band in range(0, NUMBER_OF_BANDS))
+        cursor = self.db_connection.execute(
+            '''SELECT DISTANCE, FILE_NAME from
+            (SELECT HAMMING_DISTANCE(HASH, ?) AS DISTANCE, FILE_NAME
+            from IMAGE_HASHES where ''' + condition + ''')
+            where DISTANCE <= ? AND FILE_NAME != ?
+            ORDER BY DISTANCE, FILE_NAME LIMIT ?''',
+            [to_signed(value)] + hash_bands(value) +
+            [max_distance, file_name, limit])
+        return cursor.fetchall()
@@ -0,0 +1,266 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from image_cache import fit_size
+
+
+# Modes that can be written as JPEG.  Anything else is converted first.
+JPEG_MODES = ('L', 'RGB', 'CMYK')
+
+
+# Make an empty directory next to where a directory is about to be written,
+# so it can be filled and then renamed into place.  Each call gets its own,
+# so several threads or processes can build the same thing at once.
+def make_temporary_directory(target_directory):
+    parent_directory = os.path.dirname(target_directory)
+    os.makedirs(parent_directory, exist_ok=True)
+    return tempfile.mkdtemp(suffix='.tmp',
+                            prefix=os.path.basename(target_directory) + '.',
+                            dir=parent_directory)
+
+
+# Return the directory that holds the image pyramids for a database.  It sits
+# next to the database file, e.g. results.db -> results.pyramid
+def pyramid_directory(db_name):
+    return os.path.splitext(db_name)[0] + '.pyramid'
+
+
+# A cache on disk of reduced size copies of each image.  Level 1 is half the
+# size of the original, level 2 a quarter and so on until the image is no
+# bigger than smallest_level pixels across.  When an image is shown it is
+# scaled down from the smallest level that is still at least as big as the
+# frame rather than from the original.  If the original has to be used, JPEG
+# files are decoded in draft mode so that the decoder does the first part of
+# the scaling.
+#
+# The levels for a file are kept in a directory named after a hash of the
+# file's path, modification time and size, so a changed file gets new levels.
+#
+# For zooming in, any level, including the original as level 0, can also be
+# cut into square tiles tile_size pixels across, each saved as its own file,
+# so the part of a large image being looked at can be shown without decoding
+# the rest.  Tiles are cut as they are needed, so only the parts of an image
+# that have been looked at are ever cut.
+class ImagePyramid:
+    def __init__(self, directory, smallest_level=256, quality=90,
+                 tile_size=256):
+        self.directory = directory
+        self.smallest_level = smallest_level
+        self.quality = quality
+        self.tile_size = tile_size
+
+    # Return the directory holding the levels for an image file
+    def key_directory(self, path):
+        status = os.stat(path)
+        key = '\0'.join((os.path.abspath(path),
+                         str(status.st_mtime_ns),
+                         str(status.st_size)))
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[0:2], digest)
+
+    # Return the size of a level of an image
+    @staticmethod
+    def level_size(original_size, level):
+        return (max(1, original_size[0] >> level),
+                max(1, original_size[1] >> level))
+
+    # Return the number of levels kept for an image of a given size
+    def number_of_levels(self, original_size):
+        levels = 0
+        while max(self.level_size(original_size, levels)) > \
+                self.smallest_level:
+            levels += 1
+        return levels
+
+    @staticmethod
+    def level_file(key_directory, level):
+        return os.path.join(key_directory, str(level) + '.jpg')
+
+    # Return the directory holding the tiles of a level
+    @staticmethod
+    def tile_directory(key_directory, level):
+        return os.path.join(key_directory, 'tiles' + str(level))
+
+    @staticmethod
+    def tile_file(tile_directory, column, row):
+        return os.path.join(tile_directory,
+                            str(column) + '_' + str(row) + '.jpg')
+
+    # Return True if the levels for an image have been built
+    def is_built(self, path):
+        return os.path.isdir(self.key_directory(path))
+
+    # Make and save every level of an image.  Returns False if the levels were
+    # already there.
+    def build(self, path):
+        key_directory = self.key_directory(path)
+        if os.path.isdir(key_directory):
+            return False
+
+        image = Image.open(path)
+        original_size = image.size
+        levels = self.number_of_levels(original_size)
+
+        # Level 1 is only half size so the JPEG decoder can skip some work
+        image.draft(image.mode, self.level_size(original_size, 1))
+        if image.mode not in JPEG_MODES:
+            image = image.convert('RGB')
+
+        # Write the levels to a temporary directory and rename it when they
+        # are all there so that a partly built pyramid is never used.  If
+        # the build fails or loses the race the temporary directory is
+        # removed.
+        temporary_directory = make_temporary_directory(key_directory)
+        try:
+            for level in range(1, levels + 1):
+                image = image.resize(self.level_size(original_size, level),
+                                     Image.BOX)
+                image.save(self.level_file(temporary_directory, level),
+                           'JPEG',
+                           quality=self.quality)
+            try:
+                os.rename(temporary_directory, key_directory)
+            except OSError:
+                # Another thread or process finished building the same
+                # pyramid first
+                pass
+        finally:
+            shutil.rmtree(temporary_directory, ignore_errors=True)
+        return True
+
+    # Return the (column, row) of every tile of a level
+    def level_tiles(self, original_size, level):
+        width, height = self.level_size(original_size, level)
+        return [(column, row)
+                for row in range(0, -(-height // self.tile_size))
+                for column in range(0, -(-width // self.tile_size))]
+
+    # Return a level of an image decoded and ready to be cut into tiles,
+    # building the levels first if they aren't there
+    def level_image(self, path, level):
+        if level == 0:
+            image = Image.open(path)
+        else:
+            self.build(path)
+            image = Image.open(self.level_file(self.key_directory(path),
+                                               level))
+        if image.mode not in JPEG_MODES:
+            image = image.convert('RGB')
+        image.load()
+        return image
+
+    # Cut tiles from a level of an image and save them.  tiles is a list of
+    # (column, row), or None for every tile of the level.  Tiles that are
+    # already there are skipped and the level is only decoded if some are
+    # missing.  A level that is already decoded can be given as image.
+    # Returns False if every tile was already there.
+    #
+    # Each tile is written under a temporary name and renamed into place, so
+    # a partly written tile is never read and several threads or processes
+    # can cut the same tiles at once.
+    def build_tiles(self, path, level, tiles=None, image=None):
+        self.build(path)
+        tile_directory = self.tile_directory(self.key_directory(path), level)
+        if tiles is None:
+            with Image.open(path) as original:
+                tiles = self.level_tiles(original.size, level)
+        missing = [(column, row) for column, row in tiles
+                   if not os.path.exists(self.tile_file(tile_directory,
+                                                        column, row))]
+        if len(missing) == 0:
+            return False
+
+        if image is None:
+            image = self.level_image(path, level)
+        os.makedirs(tile_directory, exist_ok=True)
+        width, height = image.size
+        for column, row in missing:
+            left = column * self.tile_size
+            top = row * self.tile_size
+            tile = image.crop((left, top,
+                               min(left + self.tile_size, width),
+                               min(top + self.tile_size, height)))
+            handle, temporary_file = tempfile.mkstemp(suffix='.tmp',
+                                                      dir=tile_directory)
+            try:
+                with os.fdopen(handle, 'wb') as tile_file:
+                    tile.save(tile_file, 'JPEG', quality=self.quality)
+                os.replace(temporary_file,
+                           self.tile_file(tile_directory, column, row))
+            finally:
+                if os.path.exists(temporary_file):
+                    os.remove(temporary_file)
+        return True
+
+    # Open an image at the smallest size that is still big enough to fill a
+    # frame.  If build_missing is set, the levels are made when they don't
+    # exist yet.  The original size of the image is returned along with it.
+    def open(self, path, frame_size, aspect_locked=True, build_missing=True):
+        original = Image.open(path)
+        original_size = original.size
+        target_size = fit_size(original_size, frame_size, aspect_locked)
+
+        key_directory = self.key_directory(path)
+        if build_missing and not os.path.isdir(key_directory):
+            self.build(path)
+
+        # Find the deepest level that is at least as big as the target
+        best_level = 0
+        for level in range(1, self.number_of_levels(original_size) + 1):
+            level_width, level_height = self.level_size(original_size, level)
+            if level_width < target_size[0] or level_height < target_size[1]:
+                break
+            best_level = level
+
+        if best_level > 0:
+            level_file = self.level_file(key_directory, best_level)
+            if os.path.exists(level_file):
+                image = Image.open(level_file)
+                image.load()
+                return image, original_size
+
+        original.draft(original.mode, target_size)
+        original.load()
+        return original, original_size
+
+
+# Build the pyramid for one file, and the tiles of every level if tiles is
+# set.  Used by the worker processes in build_pyramids so must be at module
+# level.  Returns None if the file isn't an image.
+def build_pyramid(directory, path, tiles=False):
+    try:
+        pyramid = ImagePyramid(directory)
+        built = pyramid.build(path)
+        if tiles:
+            with Image.open(path) as image:
+                levels = pyramid.number_of_levels(image.size)
+            for level in range(0, levels + 1):
+                built = pyramid.build_tiles(path, level) or built
+        return built
+    except (OSError, Image.DecompressionBombError):
+        return None
+
+
+# Build the pyramids for a list of image files ahead of time on a pool of
+# processes, along with their tiles if tiles is set.  Returns the number of
+# pyramids built, already present and files that couldn't be read.
+def build_pyramids(directory, paths, workers=None, tiles=False):
+    built = 0
+    present = 0
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(build_pyramid,
+                                   [directory] * len(paths),
+                                   paths,
+                                   [tiles] * len(paths),
+                                   chunksize=16):
+            if result is None:
+                failed += 1
+            elif result:
+                built += 1
+            else:
+                present += 1
+    return built, present, failed
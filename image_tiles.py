@@ -0,0 +1,292 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from image_cache import CachedImage, ImageCache
+
+
+# Shows part of an image zoomed in.  The view is drawn from the tiles of the
+# pyramid level nearest to the zoom, so only the tiles that can be seen are
+# decoded and scaled however big the image is.  Decoded tiles are kept in an
+# ImageCache so panning back over them is quick.
+#
+# Tiles are cut on a worker thread the first time they are in view, so only
+# the parts of an image that are looked at are ever cut.  Until they are
+# ready the reduced copy of the image that is already showing is scaled up
+# instead.  The level they are cut from is kept decoded on the worker, so
+# moving around the same image doesn't decode it again.  build-pyramid
+# --tiles cuts every tile ahead of time.
+#
+# The view is described by a zoom, the number of frame pixels for each pixel
+# of the original, and the point of the original at the centre of the frame.
+# A zoom of None means the whole image is fitted to the frame the usual way.
+class TileView:
+    def __init__(self, pyramid, cache=None, max_zoom=4.0):
+        self.pyramid = pyramid
+        self.cache = cache if cache is not None \
+            else ImageCache(128 * 1024 * 1024)
+        self.max_zoom = max_zoom
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        # Only used on the worker thread
+        self.source_key = None
+        self.source = None
+
+        self.path = None
+        self.set_image(None, None, None)
+
+    # Start showing a new image fitted to the frame.  image is a decoded copy
+    # of the whole image, possibly reduced, to show until the tiles are ready.
+    def set_image(self, path, original_size, image):
+        if path != self.path:
+            self.executor.submit(self.release_source)
+        self.path = path
+        self.original_size = original_size
+        self.image = image
+        self.key_directory = None
+        self.building = None
+        self.building_level = None
+        self.failed = set()
+        self.fit()
+
+    # Go back to fitting the whole image to the frame
+    def fit(self):
+        self.zoom = None
+        self.center = None
+
+        # Set when the view was chosen automatically for an entry box rather
+        # than by the operator
+        self.automatic = False
+
+    def zoomed(self):
+        return self.zoom is not None and self.path is not None
+
+    # Return the zoom that fits the whole image in a frame
+    def fit_zoom(self, frame_size):
+        return min(frame_size[0] / self.original_size[0],
+                   frame_size[1] / self.original_size[1])
+
+    # Zoom in or out by a factor, keeping the point of the image under focus,
+    # a point of the frame, where it is.  Zooming out as far as the whole
+    # image goes back to fitting it.
+    def zoom_by(self, factor, frame_size, focus=None):
+        if self.path is None:
+            return
+        frame_width, frame_height = frame_size
+        if focus is None:
+            focus = (frame_width / 2, frame_height / 2)
+        zoom = self.zoom if self.zoom is not None \
+            else self.fit_zoom(frame_size)
+        center = self.center if self.center is not None \
+            else (self.original_size[0] / 2, self.original_size[1] / 2)
+
+        x = center[0] + (focus[0] - frame_width / 2) / zoom
+        y = center[1] + (focus[1] - frame_height / 2) / zoom
+        new_zoom = min(zoom * factor, self.max_zoom)
+        if new_zoom <= self.fit_zoom(frame_size):
+            self.fit()
+            return
+        self.zoom = new_zoom
+        self.center = (x - (focus[0] - frame_width / 2) / new_zoom,
+                       y - (focus[1] - frame_height / 2) / new_zoom)
+        self.automatic = False
+
+    # Move the image by a number of frame pixels
+    def pan(self, dx, dy):
+        if self.zoom is None:
+            return
+        self.center = (self.center[0] - dx / self.zoom,
+                       self.center[1] - dy / self.zoom)
+        self.automatic = False
+
+    # Zoom to fit a region of the image in the frame.  The region is given
+    # as (left, top, right, bottom) fractions of the width and height of the
+    # image, so it suits every scan of the same form whatever its size.
+    def show_region(self, region, frame_size):
+        if self.path is None:
+            return
+        width, height = self.original_size
+        left, top, right, bottom = (region[0] * width, region[1] * height,
+                                    region[2] * width, region[3] * height)
+        zoom = min(frame_size[0] / max(right - left, 1),
+                   frame_size[1] / max(bottom - top, 1),
+                   self.max_zoom)
+        if zoom <= self.fit_zoom(frame_size):
+            self.fit()
+        else:
+            self.zoom = zoom
+            self.center = ((left + right) / 2, (top + bottom) / 2)
+        self.automatic = True
+
+    # Return the region of the image being shown as fractions, or None if
+    # the whole image is shown
+    def region(self, frame_size):
+        if not self.zoomed():
+            return None
+        left, top, right, bottom = self.visible_box(frame_size)
+        width, height = self.original_size
+        return left / width, top / height, right / width, bottom / height
+
+    # Return the box of the original, in its pixels, that is shown in the
+    # frame.  The centre is moved if need be so the view doesn't go past the
+    # edges of the image.
+    def visible_box(self, frame_size):
+        box = []
+        center = []
+        for axis in (0, 1):
+            half = frame_size[axis] / (2 * self.zoom)
+            length = self.original_size[axis]
+            if 2 * half >= length:
+                middle = length / 2
+            else:
+                middle = min(max(self.center[axis], half), length - half)
+            center.append(middle)
+            box.append((max(middle - half, 0), min(middle + half, length)))
+        self.center = tuple(center)
+        return box[0][0], box[1][0], box[0][1], box[1][1]
+
+    # Return the pyramid level with the fewest pixels that still has at
+    # least one for every pixel shown at a zoom
+    def level_for(self, zoom):
+        if zoom >= 1:
+            return 0
+        return min(int(math.floor(math.log2(1 / zoom))),
+                   self.pyramid.number_of_levels(self.original_size))
+
+    # Return True while tiles are being cut for the image
+    def is_building(self):
+        return self.building is not None and not self.building.done()
+
+    # Return True if the tiles of a level that cover a box of the original
+    # are ready, starting to cut any that are missing in the background.  A
+    # level whose tiles can't be cut isn't tried again.
+    def tiles_ready(self, level, box):
+        if level in self.failed:
+            return False
+        if self.key_directory is None:
+            self.key_directory = self.pyramid.key_directory(self.path)
+        tile_directory = self.pyramid.tile_directory(self.key_directory,
+                                                     level)
+        _level_box, columns, rows = self.tile_range(level, box)
+        missing = []
+        for row in rows:
+            for column in columns:
+                tile_file = self.pyramid.tile_file(tile_directory, column,
+                                                   row)
+                if tile_file not in self.cache and \
+                        not os.path.exists(tile_file):
+                    missing.append((column, row))
+        if len(missing) == 0:
+            return True
+
+        if self.building is not None and self.building.done():
+            if self.building.exception() is not None:
+                self.failed.add(self.building_level)
+            self.building = None
+        if self.building is None and level not in self.failed:
+            self.building = self.executor.submit(self.cut_tiles, self.path,
+                                                 level, missing)
+            self.building_level = level
+        return False
+
+    # Cut tiles on the worker thread, decoding the level they come from only
+    # if it isn't the one that was decoded last
+    def cut_tiles(self, path, level, tiles):
+        if self.source_key != (path, level):
+            self.release_source()
+            self.source = self.pyramid.level_image(path, level)
+            self.source_key = (path, level)
+        self.pyramid.build_tiles(path, level, tiles, self.source)
+
+    # Let go of the decoded level, which for a large original can be
+    # hundreds of megabytes.  Run on the worker thread.
+    def release_source(self):
+        self.source_key = None
+        self.source = None
+
+    # Return a decoded tile
+    def tile(self, tile_directory, column, row):
+        tile_file = self.pyramid.tile_file(tile_directory, column, row)
+        entry = self.cache.get(tile_file)
+        if entry is None:
+            image = Image.open(tile_file)
+            image.load()
+            entry = CachedImage(image)
+            self.cache.put(tile_file, entry)
+        return entry.image
+
+    # Draw the view for a frame.  A quality of 1 is resampled with LANCZOS,
+    # otherwise a quicker filter is used while the view is moving.
+    def render(self, frame_size, quality):
+        left, top, right, bottom = self.visible_box(frame_size)
+        size = (max(1, int(round((right - left) * self.zoom))),
+                max(1, int(round((bottom - top) * self.zoom))))
+        resample = Image.LANCZOS if quality == 1 else Image.BILINEAR
+
+        level = self.level_for(self.zoom)
+        if self.tiles_ready(level, (left, top, right, bottom)):
+            try:
+                return self.render_tiles(level, (left, top, right, bottom),
+                                         size, resample)
+            except OSError:
+                # A tile has been removed from the disk since it was checked
+                pass
+
+        # Scale up the part of the copy that is already decoded
+        scale_x = self.image.size[0] / self.original_size[0]
+        scale_y = self.image.size[1] / self.original_size[1]
+        return self.image.resize(size, resample,
+                                 box=(left * scale_x, top * scale_y,
+                                      right * scale_x, bottom * scale_y))
+
+    # Return a box of the original in the pixels of a level, along with the
+    # ranges of columns and rows of the tiles that overlap it
+    def tile_range(self, level, box):
+        level_width, level_height = self.pyramid.level_size(
+            self.original_size, level)
+        scale_x = level_width / self.original_size[0]
+        scale_y = level_height / self.original_size[1]
+        left, top, right, bottom = (box[0] * scale_x, box[1] * scale_y,
+                                    box[2] * scale_x, box[3] * scale_y)
+
+        tile_size = self.pyramid.tile_size
+        first_column = int(left) // tile_size
+        first_row = int(top) // tile_size
+        last_column = (min(int(math.ceil(right)), level_width) - 1) // \
+            tile_size
+        last_row = (min(int(math.ceil(bottom)), level_height) - 1) // \
+            tile_size
+        return ((left, top, right, bottom),
+                range(first_column, last_column + 1),
+                range(first_row, last_row + 1))
+
+    # Draw part of the image from the tiles of a level.  Only the tiles that
+    # overlap the box are decoded, pasted together and scaled.
+    def render_tiles(self, level, box, size, resample):
+        (left, top, right, bottom), columns, rows = self.tile_range(level,
+                                                                    box)
+        first_column = columns[0]
+        first_row = rows[0]
+        tile_size = self.pyramid.tile_size
+
+        tile_directory = self.pyramid.tile_directory(self.key_directory,
+                                                     level)
+        mosaic = None
+        for row in rows:
+            for column in columns:
+                tile = self.tile(tile_directory, column, row)
+                if mosaic is None:
+                    mosaic = Image.new(tile.mode,
+                                       (len(columns) * tile_size,
+                                        len(rows) * tile_size))
+                mosaic.paste(tile, ((column - first_column) * tile_size,
+                                    (row - first_row) * tile_size))
+
+        x = first_column * tile_size
+        y = first_row * tile_size
+        return mosaic.resize(size, resample,
+                             box=(left - x, top - y, right - x, bottom - y))
+
+    # Stop the worker thread
+    def close(self):
+        self.executor.shutdown(wait=True)
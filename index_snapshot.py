@@ -0,0 +1,193 @@
+import array
+import mmap
+import os
+import struct
+
+
+# A snapshot is a single file of named sections, each holding an array of
+# numbers or a table of strings.  It starts with a header giving the format
+# version and the identity and change counter of the database it was made
+# from, followed by a table of the sections and then the sections
+# themselves, each starting on an 8 byte boundary.
+#
+#   header    magic, format version, number of sections, database version,
+#             database identity
+#   sections  name, offset, length for each section
+SNAPSHOT_MAGIC = b'SOYLSNAP'
+SNAPSHOT_VERSION = 3
+HEADER = struct.Struct('<8sIIq32s')
+SECTION = struct.Struct('<32sQQ')
+
+
+# Return the file that holds the suggestion snapshot for a database.  It sits
+# next to the database file, e.g. results.db -> results.snapshot
+def snapshot_file_name(db_name):
+    return os.path.splitext(db_name)[0] + '.snapshot'
+
+
+# Create the table and triggers that count changes to the RESULTS table.  The
+# counter goes up whenever a row is inserted, replaced, updated or deleted,
+# whether by this program or anything else, so a snapshot can tell whether
+# the database has changed since it was made.  Each database is also given a
+# random identity so a snapshot can't be mistaken for one of a database that
+# has been replaced.
+def create_change_counter(db_connection):
+    db_connection.execute('''CREATE TABLE IF NOT EXISTS RESULTS_VERSION
+    (IDENTITY TEXT NOT NULL,
+    VERSION INTEGER NOT NULL
+    );''')
+    db_connection.execute('''INSERT INTO RESULTS_VERSION
+    SELECT lower(hex(randomblob(16))), 0
+    WHERE NOT EXISTS (SELECT * from RESULTS_VERSION)''')
+    create_change_triggers(db_connection)
+    db_connection.commit()
+
+
+# Create the triggers that add one to the counter for every row changed
+def create_change_triggers(db_connection):
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        db_connection.execute('''CREATE TRIGGER IF NOT EXISTS
+        RESULTS_%s_COUNTER AFTER %s ON RESULTS
+        BEGIN
+            UPDATE RESULTS_VERSION SET VERSION = VERSION + 1;
+        END''' % (event, event))
+
+
+# Stop counting changes row by row.  Used inside the transaction of a bulk
+# import, which is counted as a single change by resume_change_counter, as
+# updating the counter for every row more than doubles the time it takes.
+def pause_change_counter(db_connection):
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        db_connection.execute('DROP TRIGGER IF EXISTS RESULTS_%s_COUNTER' %
+                              event)
+
+
+def resume_change_counter(db_connection):
+    create_change_triggers(db_connection)
+    db_connection.execute('UPDATE RESULTS_VERSION SET VERSION = VERSION + 1')
+
+
+# Return the identity and change counter of a database
+def change_counter(db_connection):
+    row = db_connection.execute(
+        'SELECT IDENTITY, VERSION from RESULTS_VERSION').fetchone()
+    if row is None:
+        return None, 0
+    return row[0], row[1]
+
+
+# Gathers the sections of a snapshot and writes them to a file
+class SnapshotWriter:
+    def __init__(self):
+        self.sections = []
+
+    # Add a section of raw bytes
+    def add(self, name, data):
+        self.sections.append((name, data))
+
+    # Add a section holding an array of numbers of an array module type
+    def add_array(self, name, typecode, values):
+        self.add(name, array.array(typecode, values).tobytes())
+
+    # Add a section holding a list of strings.  The strings are stored one
+    # after another, with a second section holding the character each one
+    # starts at, so a string can contain anything, even a null character.
+    def add_strings(self, name, strings):
+        strings = list(strings)
+        offsets = [0]
+        for string in strings:
+            offsets.append(offsets[-1] + len(string))
+        self.add(name, ''.join(strings).encode('utf-8'))
+        self.add_array(name + '.offsets', 'q', offsets)
+
+    # Write the sections to a file.  It is written under a temporary name and
+    # renamed into place, so anyone reading the old file keeps seeing it as it
+    # was and a partly written file is never read.
+    def write(self, file_name, identity, version):
+        offset = HEADER.size + SECTION.size * len(self.sections)
+        table = []
+        for name, data in self.sections:
+            offset += -offset % 8
+            table.append(SECTION.pack(name.encode('utf-8'), offset,
+                                      len(data)))
+            offset += len(data)
+
+        temporary_file_name = file_name + '.' + str(os.getpid()) + '.tmp'
+        with open(temporary_file_name, 'wb') as snapshot_file:
+            snapshot_file.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+                                            len(self.sections), version,
+                                            (identity or '').encode('ascii')))
+            snapshot_file.write(b''.join(table))
+            for name, data in self.sections:
+                snapshot_file.write(b'\0' * (-snapshot_file.tell() % 8))
+                snapshot_file.write(data)
+        try:
+            os.replace(temporary_file_name, file_name)
+        except OSError:
+            # On some systems a file can't be replaced while another process
+            # has it mapped.  The old snapshot stays until next time.
+            os.remove(temporary_file_name)
+            return False
+        return True
+
+
+# A snapshot file mapped into memory read only.  Every process that opens
+# the same snapshot shares the same pages of memory.  Arrays are returned as
+# memoryviews of the mapping so nothing is copied until it is used.
+class Snapshot:
+    def __init__(self, snapshot_file):
+        self.map = mmap.mmap(snapshot_file.fileno(), 0,
+                             access=mmap.ACCESS_READ)
+        magic, format_version, number_of_sections, self.version, \
+            identity = HEADER.unpack_from(self.map, 0)
+        if magic != SNAPSHOT_MAGIC or format_version != SNAPSHOT_VERSION:
+            raise ValueError('not a snapshot this version can read')
+        self.identity = identity.rstrip(b'\0').decode('ascii') or None
+
+        self.sections = {}
+        for i in range(0, number_of_sections):
+            name, offset, length = SECTION.unpack_from(
+                self.map, HEADER.size + SECTION.size * i)
+            if offset + length > len(self.map):
+                raise ValueError('snapshot is truncated')
+            self.sections[name.rstrip(b'\0').decode('utf-8')] = \
+                (offset, length)
+        self.view = memoryview(self.map)
+
+    def __contains__(self, name):
+        return name in self.sections
+
+    # Return the bytes of a section
+    def section(self, name):
+        offset, length = self.sections[name]
+        return self.view[offset:offset + length]
+
+    # Return a section as a read only array of numbers
+    def array(self, name, typecode):
+        return self.section(name).cast(typecode)
+
+    # Return a copy of a section as an array that can be changed
+    def copy_array(self, name, typecode):
+        values = array.array(typecode)
+        values.frombytes(self.section(name))
+        return values
+
+    # Return a section as a list of strings
+    def strings(self, name):
+        text = str(self.section(name), 'utf-8')
+        offsets = self.array(name + '.offsets', 'q')
+        return [text[start:end] for start, end in zip(offsets, offsets[1:])]
+
+
+# Open a snapshot if it was made from a database with the given identity and
+# change counter.  Returns None if there is no snapshot, it can't be read or
+# the database has changed since it was made.
+def open_snapshot(file_name, identity, version):
+    try:
+        with open(file_name, 'rb') as snapshot_file:
+            snapshot = Snapshot(snapshot_file)
+    except (OSError, ValueError, struct.error):
+        return None
+    if snapshot.identity != identity or snapshot.version != version:
+        return None
+    return snapshot
@@ -0,0 +1,118 @@
+import time
+
+
+# Lets several operators, each running their own copy of the program, work
+# through the same records and database without getting in each other's way.
+# Before a record is shown it is claimed with a lease that runs out after
+# lease_seconds unless it is renewed.  Moving forward, records that are
+# leased by someone else or completed are skipped.  Moving back, an operator
+# can also return to records they completed themselves.
+#
+# Claims are made inside a BEGIN IMMEDIATE transaction, which holds SQLite's
+# write lock, so two operators can never claim the same record.
+#
+# Records are also skipped if the COMPLETION table says every field is
+# filled in, so the CompletionIndex must be created first.
+class RecordLeases:
+    def __init__(self, db_connection, operator, lease_seconds=600):
+        self.db_connection = db_connection
+        self.operator = operator
+        self.lease_seconds = lease_seconds
+
+        self.db_connection.execute('''CREATE TABLE IF NOT EXISTS LEASES
+        (RECORD_NUMBER INTEGER PRIMARY KEY,
+        OPERATOR TEXT NOT NULL,
+        EXPIRES REAL NOT NULL,
+        COMPLETED INT NOT NULL DEFAULT 0
+        );''')
+        self.db_connection.commit()
+
+    # Find the next record after start, or before it if direction is
+    # negative, that this operator is allowed to work on and lease it.  The
+    # search wraps around the end of the records.  Returns None if every
+    # other record is taken.
+    def claim(self, start, direction, number_of_records):
+        now = time.time()
+        self.db_connection.commit()
+        self.db_connection.execute('BEGIN IMMEDIATE')
+        try:
+            if direction >= 0:
+                record_number = self.find_available(
+                    'RECORD_NUMBER > ?', start, 'ASC', now, False)
+                if record_number is None:
+                    record_number = self.find_available(
+                        'RECORD_NUMBER >= ?', 0, 'ASC', now, False)
+            else:
+                record_number = self.find_available(
+                    'RECORD_NUMBER < ?', start, 'DESC', now, True)
+                if record_number is None:
+                    record_number = self.find_available(
+                        'RECORD_NUMBER < ?', number_of_records, 'DESC', now,
+                        True)
+
+            if record_number is not None and record_number != start:
+                self.db_connection.execute(
+                    '''INSERT OR IGNORE INTO LEASES
+                    (RECORD_NUMBER, OPERATOR, EXPIRES) values (?, ?, ?)''',
+                    (record_number, self.operator, now + self.lease_seconds))
+                self.db_connection.execute(
+                    '''UPDATE LEASES SET OPERATOR=?, EXPIRES=?
+                    where RECORD_NUMBER=?''',
+                    (self.operator, now + self.lease_seconds, record_number))
+            else:
+                record_number = None
+            self.db_connection.commit()
+        except BaseException:
+            self.db_connection.rollback()
+            raise
+        return record_number
+
+    # Return the first record in the manifest that matches a condition and
+    # isn't leased by another operator or completed.  Records completed by
+    # this operator can be included.  Records that were completed without a
+    # lease, in single user mode or by an import, are found from the
+    # COMPLETION table kept by CompletionIndex.
+    def find_available(self, condition, value, order, now, own_completed):
+        row = self.db_connection.execute(
+            '''SELECT MANIFEST.RECORD_NUMBER from MANIFEST
+            LEFT JOIN LEASES
+            on LEASES.RECORD_NUMBER = MANIFEST.RECORD_NUMBER
+            LEFT JOIN COMPLETION
+            on COMPLETION.RECORD_NUMBER = MANIFEST.RECORD_NUMBER
+            where MANIFEST.''' + condition + ''' AND
+            ((LEASES.RECORD_NUMBER IS NULL AND
+            COMPLETION.COMPLETE IS NOT 1) OR
+            (LEASES.COMPLETED = 0 AND LEASES.OPERATOR = ?) OR
+            (LEASES.COMPLETED = 0 AND LEASES.EXPIRES < ? AND
+            COMPLETION.COMPLETE IS NOT 1) OR
+            (LEASES.COMPLETED = 1 AND LEASES.OPERATOR = ? AND ?))
+            ORDER BY MANIFEST.RECORD_NUMBER ''' + order + ''' LIMIT 1''',
+            (value, self.operator, now, self.operator,
+             1 if own_completed else 0)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    # Extend the lease on a record that is still being worked on
+    def renew(self, record_number):
+        self.db_connection.execute(
+            '''UPDATE LEASES SET EXPIRES=?
+            where RECORD_NUMBER=? AND OPERATOR=?''',
+            (time.time() + self.lease_seconds, record_number, self.operator))
+        self.db_connection.commit()
+
+    # Return the SQL that gives up the lease on a record.  If the record was
+    # completed, with every field filled in, it is marked so that other
+    # operators skip it, otherwise the lease is removed so someone else can
+    # take it, even if this operator had completed it before.  The
+    # statement is run in the same transaction that saves the record, so
+    # other operators never see a record that is released but not yet
+    # saved.
+    def release_statement(self, record_number, completed):
+        if completed:
+            return ('''UPDATE LEASES SET COMPLETED=1, EXPIRES=?
+                    where RECORD_NUMBER=? AND OPERATOR=?''',
+                    (time.time(), record_number, self.operator))
+        return ('''DELETE FROM LEASES
+                where RECORD_NUMBER=? AND OPERATOR=?''',
+                (record_number, self.operator))
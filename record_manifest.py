@@ -0,0 +1,193 @@
+import os
+from collections import defaultdict
+
+
+# The list of image files to process, kept in the database so that it doesn't
+# have to be rebuilt every time the program starts.  Each file gets a record
+# number the first time it is found.  Numbers never change, so new files are
+# added to the end and the order stays the same from one run to the next.
+#
+# File names are stored relative to the image directory with / between
+# directories, so files in the top level directory keep the plain names used
+# in the RESULTS table.
+#
+# Scanning is incremental.  The modification time of every directory is
+# remembered and only directories that have changed since the last scan are
+# listed again.  Subdirectories are remembered even when the scan isn't
+# recursive, with a modification time of zero until they are first listed.
+#
+# The highest record number is read and the new files added in one
+# transaction that holds SQLite's write lock, so two programs scanning the
+# same database at once can't give the same number to different files.
+#
+# Record names are read from the database a page at a time as they are
+# needed, so the object can be indexed like the list it replaces without
+# holding every name in memory.
+class RecordManifest:
+    def __init__(self, db_connection, directory_name, recursive=False,
+                 page_size=256):
+        self.db_connection = db_connection
+        self.directory_name = directory_name
+        self.recursive = recursive
+        self.page_size = page_size
+        self.page_start = None
+        self.page = []
+        self.length = 0
+
+        self.db_connection.execute('''CREATE TABLE IF NOT EXISTS MANIFEST
+        (RECORD_NUMBER INTEGER PRIMARY KEY,
+        FILE_NAME TEXT NOT NULL UNIQUE,
+        DIRECTORY TEXT NOT NULL
+        );''')
+        self.db_connection.execute('''CREATE INDEX IF NOT EXISTS
+        MANIFEST_DIRECTORY on MANIFEST (DIRECTORY);''')
+        self.db_connection.execute('''CREATE TABLE IF NOT EXISTS
+        MANIFEST_DIRECTORIES
+        (DIRECTORY TEXT PRIMARY KEY,
+        MODIFIED INT NOT NULL
+        );''')
+        self.db_connection.commit()
+        self.count_records()
+
+    def __len__(self):
+        return self.length
+
+    # Return the file name of a record.  Record numbers start at zero.
+    def __getitem__(self, record_number):
+        if record_number < 0:
+            record_number += self.length
+        if not 0 <= record_number < self.length:
+            raise IndexError('record number out of range')
+        if self.page_start is None or \
+                not self.page_start <= record_number < \
+                self.page_start + len(self.page):
+            self.page_start = record_number - record_number % self.page_size
+            cursor = self.db_connection.execute(
+                '''SELECT FILE_NAME from MANIFEST
+                where RECORD_NUMBER >= ? AND RECORD_NUMBER < ?
+                ORDER BY RECORD_NUMBER''',
+                (self.page_start, self.page_start + self.page_size))
+            self.page = [row[0] for row in cursor]
+        return self.page[record_number - self.page_start]
+
+    def __iter__(self):
+        for record_number in range(0, self.length):
+            yield self[record_number]
+
+    # Return the record number of a file, or None if it isn't in the manifest
+    def record_number(self, file_name):
+        row = self.db_connection.execute(
+            'SELECT RECORD_NUMBER from MANIFEST where FILE_NAME=?',
+            (file_name,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    # Return the record number of the first file, in order of name, whose
+    # name starts with some text, or None if there isn't one.  The unique
+    # index on FILE_NAME means only one row is read.
+    def find_file_name(self, text):
+        row = self.db_connection.execute(
+            '''SELECT RECORD_NUMBER, FILE_NAME from MANIFEST
+            where FILE_NAME >= ? ORDER BY FILE_NAME LIMIT 1''',
+            (text,)).fetchone()
+        if row is None or not row[1].startswith(text):
+            return None
+        return row[0]
+
+    def count_records(self):
+        row = self.db_connection.execute(
+            'SELECT MAX(RECORD_NUMBER) from MANIFEST').fetchone()
+        self.length = 0 if row[0] is None else row[0] + 1
+
+    # Look for files that have been added since the last scan and give them
+    # record numbers.  Returns the number of new records.
+    def scan(self):
+        known_directories = dict(self.db_connection.execute(
+            'SELECT DIRECTORY, MODIFIED from MANIFEST_DIRECTORIES'))
+        known_subdirectories = defaultdict(list)
+        for directory in known_directories:
+            if directory != '':
+                parent = directory.rpartition('/')[0]
+                known_subdirectories[parent].append(directory)
+
+        new_records = 0
+        pending = ['']
+        while pending:
+            relative_directory = pending.pop()
+            directory_path = os.path.join(self.directory_name,
+                                          relative_directory)
+            try:
+                modified = os.stat(directory_path).st_mtime_ns
+            except OSError:
+                continue
+
+            if known_directories.get(relative_directory) == modified:
+                # Nothing has been added here, but subdirectories may have
+                # changed
+                if self.recursive:
+                    pending.extend(sorted(
+                        known_subdirectories[relative_directory],
+                        reverse=True))
+                continue
+
+            file_names, subdirectories = self.list_directory(
+                directory_path, relative_directory)
+            self.db_connection.commit()
+            self.db_connection.execute('BEGIN IMMEDIATE')
+            try:
+                new_records += self.add_records(relative_directory,
+                                                file_names)
+                self.db_connection.execute(
+                    '''INSERT OR REPLACE INTO MANIFEST_DIRECTORIES
+                    values (?, ?)''', (relative_directory, modified))
+                self.db_connection.executemany(
+                    '''INSERT OR IGNORE INTO MANIFEST_DIRECTORIES
+                    values (?, 0)''',
+                    ((directory,) for directory in subdirectories))
+                self.db_connection.commit()
+            except BaseException:
+                self.db_connection.rollback()
+                raise
+            if self.recursive:
+                # Walk subdirectories in sorted order.  They are popped off
+                # the end of the list so they are added in reverse.
+                pending.extend(reversed(subdirectories))
+
+        self.count_records()
+        self.page_start = None
+        return new_records
+
+    # List the files and subdirectories in a directory, sorted by name
+    @staticmethod
+    def list_directory(directory_path, relative_directory):
+        prefix = relative_directory + '/' if relative_directory else ''
+        file_names = []
+        subdirectories = []
+        with os.scandir(directory_path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        subdirectories.append(prefix + entry.name)
+                    else:
+                        file_names.append(prefix + entry.name)
+                except OSError:
+                    pass
+        file_names.sort()
+        subdirectories.sort()
+        return file_names, subdirectories
+
+    # Give record numbers to the files in a directory that don't have one.
+    # Must be called inside a BEGIN IMMEDIATE transaction.
+    def add_records(self, relative_directory, file_names):
+        known = set(row[0] for row in self.db_connection.execute(
+            'SELECT FILE_NAME from MANIFEST where DIRECTORY=?',
+            (relative_directory,)))
+        new_file_names = [file_name for file_name in file_names
+                          if file_name not in known]
+        self.count_records()
+        self.db_connection.executemany(
+            'INSERT INTO MANIFEST values (?, ?, ?)',
+            ((self.length + offset, file_name, relative_directory)
+             for offset, file_name in enumerate(new_file_names)))
+        return len(new_file_names)
@@ -0,0 +1,214 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+
+# Writes records to the RESULTS table on a background thread so that saving
+# never makes the user wait for the disk.  The database is switched to write
+# ahead logging, and all the attributes of a record are written in a single
+# transaction, so a record is either saved completely or not at all even if
+# the program crashes.  Records that queue up while a write is in progress
+# are written together in the next transaction.
+#
+# The queue is bounded.  If the disk falls too far behind, write() blocks
+# until there is room rather than using more and more memory.
+#
+# Records are never dropped.  Another program, such as an import or another
+# operator, can hold the database's write lock for a long time, so the
+# writer waits up to timeout seconds for it and then keeps trying again,
+# waiting longer each time, until the records are written.
+#
+# If an operator is given, every attribute that changes is also recorded in
+# the RESULTS_CHANGES table along with the value it replaced, so that other
+# operators sharing the database can keep their suggestions up to date.
+class ResultWriter:
+    def __init__(self, db_name, max_pending=64, operator=None, timeout=30,
+                 max_retry_delay=5.0):
+        self.db_name = db_name
+        self.operator = operator
+        self.max_retry_delay = max_retry_delay
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+
+        # Records waiting to be written, so they can be flushed before they
+        # are read back
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+
+        # The connection is made here so that any problem opening the
+        # database is reported straight away, but it is only used by the
+        # writer thread
+        self.db_connection = sqlite3.connect(db_name,
+                                             timeout=timeout,
+                                             check_same_thread=False)
+        enable_write_ahead_log(self.db_connection)
+        if self.operator is not None:
+            create_change_log(self.db_connection)
+
+        self.thread = threading.Thread(target=self.run,
+                                       name='ResultWriter',
+                                       daemon=True)
+        self.thread.start()
+
+    # Queue the attributes of a record to be written.  values is a list
+    # indexed by attribute number.  statements is a list of (sql, parameters)
+    # pairs that are run in the same transaction.
+    def write(self, file_name, values, statements=()):
+        with self.pending_lock:
+            self.pending[file_name] = self.pending.get(file_name, 0) + 1
+        self.queue.put((file_name, list(values), list(statements)))
+
+    # Return True if a record has been queued but not yet written
+    def is_pending(self, file_name):
+        with self.pending_lock:
+            return file_name in self.pending
+
+    # Wait until everything that has been queued is in the database
+    def flush(self):
+        self.queue.join()
+        self.raise_error()
+
+    # Write anything still queued and stop the writer thread
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.db_connection.close()
+        self.raise_error()
+
+    # Report an error from the writer thread in the thread that is using the
+    # writer
+    def raise_error(self):
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    # Take records off the queue and write them until None is received
+    def run(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+
+            # Gather up anything else that is already waiting
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+            records = [item for item in batch if item is not None]
+
+            # If the records can't be written for any other reason than the
+            # database being busy, the error is logged and raised in the
+            # thread using the writer the next time it flushes, and the
+            # records are marked as done so flush() and close() don't wait
+            # for them forever
+            try:
+                self.write_until_done(records)
+            except Exception as e:
+                logging.getLogger('soylentOCR.result_writer').exception(
+                    'Failed to write %d records', len(records))
+                self.error = e
+            finally:
+                with self.pending_lock:
+                    for file_name, _values, _statements in records:
+                        self.pending[file_name] -= 1
+                        if self.pending[file_name] == 0:
+                            del self.pending[file_name]
+                for _item in batch:
+                    self.queue.task_done()
+
+    # Write a group of records, trying again for as long as the database is
+    # locked or busy
+    def write_until_done(self, records):
+        delay = 0.1
+        while True:
+            try:
+                self.write_records(records)
+                return
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) and 'busy' not in str(e):
+                    raise
+                logging.getLogger('soylentOCR.result_writer').warning(
+                    '%s, trying to write %d records again in %.1f s',
+                    e, len(records), delay)
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+
+    # Write a group of records in one transaction
+    def write_records(self, records):
+        if len(records) == 0:
+            return
+        with self.db_connection:
+            # Take the write lock straight away so that the values logged as
+            # replaced can't be changed by someone else before they are
+            self.db_connection.execute('BEGIN IMMEDIATE')
+            for file_name, values, statements in records:
+                if self.operator is not None:
+                    self.log_changes(file_name, values)
+                self.db_connection.executemany(
+                    "INSERT OR REPLACE INTO RESULTS values (?, ?, ?)",
+                    [(file_name, str(index), value)
+                     for index, value in enumerate(values)])
+                for sql, parameters in statements:
+                    self.db_connection.execute(sql, parameters)
+
+    # Record the attributes of a record that are about to change
+    def log_changes(self, file_name, values):
+        old_values = dict(self.db_connection.execute(
+            '''SELECT ATTRIBUTE_NUMBER, ATTRIBUTE from RESULTS
+            where FILE_NAME=?''', (file_name,)))
+        self.db_connection.executemany(
+            '''INSERT INTO RESULTS_CHANGES
+            (OPERATOR, FILE_NAME, ATTRIBUTE_NUMBER, OLD_ATTRIBUTE, ATTRIBUTE)
+            values (?, ?, ?, ?, ?)''',
+            [(self.operator, file_name, index, old_values.get(index), value)
+             for index, value in enumerate(values)
+             if old_values.get(index) != value])
+
+
+# Switch a database to write ahead logging.  Readers no longer block the
+# writer, and with synchronous set to NORMAL a commit doesn't wait for the
+# disk while the database still can't be corrupted by a crash.
+def enable_write_ahead_log(db_connection):
+    db_connection.execute('PRAGMA journal_mode=WAL')
+    db_connection.execute('PRAGMA synchronous=NORMAL')
+
+
+# Create the table that records changes to attributes
+def create_change_log(db_connection):
+    db_connection.execute('''CREATE TABLE IF NOT EXISTS RESULTS_CHANGES
+    (SEQUENCE INTEGER PRIMARY KEY AUTOINCREMENT,
+    OPERATOR TEXT NOT NULL,
+    FILE_NAME TEXT NOT NULL,
+    ATTRIBUTE_NUMBER INT NOT NULL,
+    OLD_ATTRIBUTE TEXT,
+    ATTRIBUTE TEXT
+    );''')
+    db_connection.commit()
+
+
+# Return the sequence number of the most recent change
+def latest_change(db_connection):
+    row = db_connection.execute(
+        'SELECT MAX(SEQUENCE) from RESULTS_CHANGES').fetchone()
+    return 0 if row[0] is None else row[0]
+
+
+# Return the changes made by other operators after a sequence number as
+# (attribute number, old value, new value) rows, along with the sequence
+# number of the last change
+def read_changes(db_connection, after, operator):
+    changes = []
+    cursor = db_connection.execute(
+        '''SELECT SEQUENCE, ATTRIBUTE_NUMBER, OLD_ATTRIBUTE, ATTRIBUTE
+        from RESULTS_CHANGES where SEQUENCE > ? AND OPERATOR != ?
+        ORDER BY SEQUENCE''', (after, operator))
+    last = after
+    for sequence, field, old_value, new_value in cursor:
+        changes.append((field, old_value, new_value))
+        last = sequence
+    return last, changes
@@ -1,8 +1,79 @@
 import tkinter.ttk
+import tkinter.simpledialog
 import tkinter
 import sqlite3
+import argparse
+import contextlib
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image, ImageTk
-from os import walk
+from suggestions import SuggestionEngine, FIELD_RANKING, \
+    FIELD_ONLY_RANKING, GLOBAL_RANKING
+from image_cache import ImagePrefetcher, fit_size
+from image_pyramid import ImagePyramid, pyramid_directory, build_pyramids
+from result_writer import ResultWriter, enable_write_ahead_log, \
+    create_change_log, latest_change, read_changes
+from record_manifest import RecordManifest
+from record_leases import RecordLeases
+from completion_index import CompletionIndex
+from image_hash import ImageHashes
+from image_tiles import TileView
+from field_regions import FieldRegions
+from bulk_transfer import import_results, export_results
+from index_snapshot import snapshot_file_name, create_change_counter, \
+    change_counter
+from telemetry import Telemetry, timed
+from stepwise import run_steps
+
+
+# Directory of images to process and the database the results are stored in
+IMAGE_DIRECTORY = "images"
+DATABASE_NAME = 'results.db'
+
+# Number of attributes entered for each record
+NUMBER_OF_FIELDS = 10
+
+
+# Connect to the database.  If it doesn't exist it is created
+# Create a table for the table if it doesn't exist
+def open_database():
+    db_connection = sqlite3.connect(DATABASE_NAME)
+    enable_write_ahead_log(db_connection)
+    db_connection.execute('''CREATE TABLE IF NOT EXISTS RESULTS
+    (FILE_NAME TEXT NOT NULL,
+    ATTRIBUTE_NUMBER INT NOT NULL,
+    ATTRIBUTE TEXT,
+    PRIMARY KEY (FILE_NAME, ATTRIBUTE_NUMBER)
+    );''')
+    db_connection.commit()
+    create_change_counter(db_connection)
+    return db_connection
+
+
+# Rebuild the suggestion snapshot in a separate process, which carries on if
+# this one exits first
+def start_snapshot_rebuild():
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), 'snapshot'],
+                     stdout=subprocess.DEVNULL)
+
+
+# Open the database and bring the list of records up to date with the files
+# in the image directory
+def open_manifest(recursive=False):
+    db_connection = open_database()
+    manifest = RecordManifest(db_connection, IMAGE_DIRECTORY, recursive)
+    manifest.scan()
+    return manifest
+
+
+# Bring the list of records up to date on a worker thread.  SQLite
+# connections can't be shared between threads, so it has its own.
+def rescan_manifest(recursive):
+    manifest = open_manifest(recursive)
+    manifest.db_connection.close()
 
 
 # Manage the label that provides suggestions
@@ -74,20 +145,80 @@ class EntryRow:
 
 # Main Frame that contains the application
 class MainApplication(tkinter.ttk.Frame):
-    def __init__(self, parent):
+    def __init__(self, parent, recursive=False, operator=None,
+                 telemetry=False, fuzzy=False, ranking=None):
         # Initialise variables
-        self.numberOfEntryFields = 10
+        self.numberOfEntryFields = NUMBER_OF_FIELDS
         self.currentRecord = 0
         self.currentEntryField = 0
         self.image = None
+        self.cached_image = None
         self.photo = None
         self.recordPosition = 0
-        self.suggestion_search = []
+        # How suggestions are ranked for each entry field, for example
+        # {0: suggestions.GLOBAL_RANKING}, set with --ranking.  The ranking
+        # under the key None is used for fields that aren't listed, and if
+        # there isn't one they offer values entered in the same field first.
+        self.suggestion_ranking = dict(ranking or {})
+        self.suggestion_engine = SuggestionEngine(
+            default_ranking=self.suggestion_ranking.pop(None, FIELD_RANKING),
+            fuzzy=fuzzy)
+
+        # Suggestions are refreshed at most once each time Tk is idle.  While
+        # entry boxes are being filled by the program, refreshes are held back
+        # altogether.  If the last refresh was less than suggestion_debounce
+        # milliseconds ago the next one waits that long, so fast typing
+        # doesn't queue up work.
+        self.suggestion_refresh_pending = None
+        self.suggestion_suspend_count = 0
+        self.suggestions_stale = False
+        self.suggestion_debounce = 30
+        self.last_suggestion_refresh = 0.0
+
+        # The search for suggestions is run a slice of suggestion_slice
+        # seconds at a time so keystrokes are handled in between.  A search
+        # still running when a new one starts is dropped.
+        self.suggestion_steps = None
+        self.suggestion_slice_pending = None
+        self.suggestion_slice = 0.005
+        self.suggestion_search_start = 0.0
+
+        # Values stored in the database for the current record.  These are
+        # replaced when the record is saved.
+        self.record_values = []
         self.image_aspect_locked = True
 
+        # Images are decoded on worker threads before they are needed.  This
+        # many records either side of the current one are kept ready.  Reduced
+        # copies of each image are kept on disk next to the database.
+        self.image_pyramid = ImagePyramid(pyramid_directory(DATABASE_NAME))
+        self.image_prefetcher = ImagePrefetcher(pyramid=self.image_pyramid)
+        self.prefetch_next = 3
+        self.prefetch_previous = 1
+
+        # Zooming in draws just the part of the image that can be seen from
+        # tiles of the pyramid.  Each step of the mouse wheel or Control-plus
+        # zooms by zoom_step.  While tiles are being cut the view is drawn
+        # again every tile_poll_delay milliseconds until they are ready.
+        self.tile_view = TileView(self.image_pyramid)
+        self.zoom_step = 1.25
+        self.zoom_refresh_delay = 150
+        self.tile_poll_delay = 200
+        self.tile_poll_pending = None
+        self.image_refresh_pending = None
+        self.drag_position = None
+
         # When changing records set focus to first entry box
         self.rehome_entry_focus = True
 
+        # Time the code that runs on every keystroke and record change.
+        # Summaries are written to a log next to the database every minute.
+        self.telemetry = Telemetry(
+            telemetry,
+            os.path.splitext(DATABASE_NAME)[0] + '.telemetry.log'
+            if telemetry else None)
+        self.telemetry_delay = 60000
+
         # Initialise frame
         tkinter.ttk.Frame.__init__(self, parent)
         self.grid(column=0, row=0, sticky="nsew")
@@ -98,26 +229,88 @@ class MainApplication(tkinter.ttk.Frame):
         self.configure(height=400, width=600)
         self.grid_propagate(False)
 
-        # Get a list of files to process from a directory
-        self.directoryName = "images"
-        self.recordList = []
-        for (directoryPath, directoryNames, fileNames)\
-                in walk(self.directoryName):
-            self.recordList.extend(fileNames)
-            break
-        self.numberOfRecords = len(self.recordList)
-
         # Connect to the database.  If it doesn't exist it is created
-        # Create a table for the table if it doesn't exist
-        self.db_name = 'results.db'
-        self.db_connection = sqlite3.connect(self.db_name)
-        self.db_connection.execute('''CREATE TABLE IF NOT EXISTS RESULTS
-        (FILE_NAME TEXT NOT NULL,
-        ATTRIBUTE_NUMBER INT NOT NULL,
-        ATTRIBUTE TEXT,
-        PRIMARY KEY (FILE_NAME, ATTRIBUTE_NUMBER)
-        );''')
+        self.db_name = DATABASE_NAME
+        self.db_connection = open_database()
+
+        # Records are saved on a background thread
+        self.result_writer = ResultWriter(self.db_name, operator=operator)
+
+        # Get the list of files to process from a directory.  The list is kept
+        # in the database and only files added since the last run are looked
+        # for.  The directory is checked again for new files every so often
+        # on a worker thread, with its own connection to the database, so a
+        # big tree of directories doesn't stop the window responding.
+        self.directoryName = IMAGE_DIRECTORY
+        self.recordList = RecordManifest(self.db_connection,
+                                         self.directoryName,
+                                         recursive)
+        self.recordList.scan()
+        self.numberOfRecords = len(self.recordList)
+        self.rescan_delay = 60000
+        self.rescan_poll_delay = 500
+        self.rescan_executor = ThreadPoolExecutor(max_workers=1)
+        self.rescan_future = None
+        self.after(self.rescan_delay, self.rescan_records)
+
+        # Keep count of the fields filled in for every record so the
+        # incomplete ones can be found straight away
+        self.completion = CompletionIndex(self.db_connection,
+                                          self.numberOfEntryFields)
+        self.completion.add_new_records()
+
+        # Hashes of the images, made by the hash-images command, used to
+        # find earlier records that are scans of the same thing
+        self.image_hashes = ImageHashes(self.db_connection)
+        self.similar_values = None
+
+        # The part of the image each entry box is read from
+        self.field_regions = FieldRegions(self.db_connection)
+
+        # In work queue mode several operators share the images and database.
+        # Each record is leased before it is shown so no two operators work
+        # on the same one.  Start on the first record that is free.
+        self.operator = operator
+        self.record_leases = None
+        self.leased_record = None
+        if self.operator is not None:
+            self.record_leases = RecordLeases(self.db_connection,
+                                              self.operator)
+            self.leased_record = self.record_leases.claim(
+                -1, 1, self.numberOfRecords)
+            if self.leased_record is not None:
+                self.currentRecord = self.leased_record
+
+        # Count how often each attribute value appears.  This is only done
+        # once, after that the counts are updated as records are saved.  In
+        # work queue mode the values entered by other operators are picked up
+        # every so often from the log of changes, starting after the last
+        # change included in the counts.
+        #
+        # The counts are read from the snapshot if the database hasn't
+        # changed since it was made.  Otherwise they are worked out from the
+        # database and a new snapshot is written from them on a worker
+        # thread for next time.
+        self.last_change = 0
+        self.snapshot_executor = ThreadPoolExecutor(max_workers=1)
+        self.snapshot_poll_delay = 500
+        self.held_back_learning = None
+        if self.operator is not None:
+            create_change_log(self.db_connection)
+        self.db_connection.execute('BEGIN')
+        if self.operator is not None:
+            self.last_change = latest_change(self.db_connection)
+        self.database_version = change_counter(self.db_connection)
+        if not self.suggestion_engine.load_snapshot(
+                snapshot_file_name(DATABASE_NAME), *self.database_version):
+            self.suggestion_engine.load(self.db_connection)
+            self.start_snapshot_write()
         self.db_connection.commit()
+        self.poll_delay = 30000
+        if self.operator is not None:
+            self.after(self.poll_delay, self.poll_operators)
+        for field, ranking in self.suggestion_ranking.items():
+            self.suggestion_engine.set_ranking(field, ranking)
 
         # Initialize a timer.  This is used to refresh the image to a high
         # quality version after the window is re-sized
@@ -175,6 +368,12 @@ class MainApplication(tkinter.ttk.Frame):
                        lambda event,
                        row_number=i: self.entry_focus_out(event, row_number))
 
+            # Control-d fills the empty entry boxes from a similar record.
+            # It is bound on each entry box, as the entry class already uses
+            # it to delete a character and would run before a binding on
+            # the window.
+            entry.bind("<Control-d>", self.fill_from_similar)
+
             # Configure spacing
             self.entry_frame.grid_rowconfigure(i, weight=1)
             self.entry_frame.grid_columnconfigure(i, pad=0)
@@ -215,6 +414,21 @@ class MainApplication(tkinter.ttk.Frame):
         # Bind Shift-Delete to clear the entry box
         self.parent.bind("<Shift-Delete>", self.clear_entry)
 
+        # F11 shows the timing histograms over the image and F12 turns the
+        # profiler on and off
+        self.telemetry_label = tkinter.Label(self.image_frame,
+                                             text="",
+                                             font="TkFixedFont",
+                                             justify="left",
+                                             anchor="nw",
+                                             background="black",
+                                             foreground="green yellow")
+        self.telemetry_shown = False
+        self.parent.bind("<F11>", self.toggle_telemetry)
+        self.parent.bind("<F12>", self.toggle_profiler)
+        if self.telemetry.enabled:
+            self.after(self.telemetry_delay, self.write_telemetry)
+
         # Initialise status label
         self.status_label = tkinter.ttk.Label(self.entry_frame,
                                               text="",
@@ -233,8 +447,29 @@ class MainApplication(tkinter.ttk.Frame):
         # Key events
         self.parent.bind("<Down>", self.down_pressed)
         self.parent.bind("<Up>", self.up_pressed)
+
+        # Page Down and Page Up move to the next or previous record that
+        # isn't complete, and Control-g goes to a record by number or name
+        self.parent.bind("<Next>", self.next_incomplete_pressed)
+        self.parent.bind("<Prior>", self.previous_incomplete_pressed)
+        self.parent.bind("<Control-g>", self.go_to_pressed)
+
         self.image_frame.bind("<Configure>", self.image_frame_resize)
 
+        # The mouse wheel zooms the image around the pointer and dragging
+        # moves it.  Control-plus and Control-minus zoom from the keyboard.
+        # Control-r remembers the part of the image shown for the current
+        # entry box, so it is zoomed to whenever the box is entered.
+        self.image_label.bind("<MouseWheel>", self.image_wheel)
+        self.image_label.bind("<Button-4>", self.image_wheel)
+        self.image_label.bind("<Button-5>", self.image_wheel)
+        self.image_label.bind("<ButtonPress-1>", self.image_drag_start)
+        self.image_label.bind("<B1-Motion>", self.image_drag)
+        self.parent.bind("<Control-equal>", self.zoom_in_pressed)
+        self.parent.bind("<Control-plus>", self.zoom_in_pressed)
+        self.parent.bind("<Control-minus>", self.zoom_out_pressed)
+        self.parent.bind("<Control-r>", self.remember_region)
+
         # Order of image, entry, suggestion and status frames
         self.image_frame.grid(column=0, row=0, sticky="nwse", rowspan=2)
         self.entry_frame.grid(column=1, row=0, sticky="ns")
@@ -266,6 +501,15 @@ class MainApplication(tkinter.ttk.Frame):
         else:
             index = (event.keycode-49) % 10 + 1
 
+        # The suggestions shown may be for text typed before the last key, or
+        # only part of the way through a search, so bring them up to date
+        # first
+        if self.suggestion_refresh_pending is not None:
+            self.after_cancel(self.suggestion_refresh_pending)
+            self.run_suggestion_refresh()
+        if self.suggestion_steps is not None:
+            self.finish_suggestion_search()
+
         try:
             self.entry_rows[self.currentEntryField].\
                 set(self.suggestion_label.get_suggestion(index - 1))
@@ -277,29 +521,103 @@ class MainApplication(tkinter.ttk.Frame):
     # Method to handle the callback from the tkinter StringVar associated with
     # the Entry boxes
     def entry_changed(self, sv):
+        self.request_suggestion_refresh()
+
+    # Arrange for the suggestions to be refreshed once Tk is idle.  Several
+    # requests before then only cause one refresh.
+    def request_suggestion_refresh(self):
+        if self.suggestion_suspend_count > 0:
+            self.suggestions_stale = True
+            return
+        if self.suggestion_refresh_pending is not None:
+            return
+        since_last = time.perf_counter() - self.last_suggestion_refresh
+        if since_last * 1000 < self.suggestion_debounce:
+            self.suggestion_refresh_pending = self.after(
+                self.suggestion_debounce, self.run_suggestion_refresh)
+        else:
+            self.suggestion_refresh_pending = self.after_idle(
+                self.run_suggestion_refresh)
+
+    # Called from the Tk event loop to do a requested refresh
+    def run_suggestion_refresh(self):
+        self.suggestion_refresh_pending = None
+        self.last_suggestion_refresh = time.perf_counter()
         self.refresh_suggestions()
 
+    # Hold back suggestion refreshes while the program changes several entry
+    # boxes, then do a single refresh afterwards if anything changed
+    @contextlib.contextmanager
+    def suggestions_suspended(self):
+        self.suggestion_suspend_count += 1
+        try:
+            yield
+        finally:
+            self.suggestion_suspend_count -= 1
+        if self.suggestion_suspend_count == 0 and self.suggestions_stale:
+            self.suggestions_stale = False
+            self.request_suggestion_refresh()
+
     # Update the suggestion frame.  Called when text in entry box is changed or
     # a different entry box gets focus
+    @timed('refresh_suggestions')
     def refresh_suggestions(self):
-        temporary_suggestions = []
-
-        # Gets the text in the current entry box and splits it into words based
-        # on locations of spaces
-        current_search = self.entry_rows[self.currentEntryField].\
-            entry.get().split()
-
-        # If entry box is empty all suggestions are valid
-        if len(current_search) == 0:
-            temporary_suggestions = self.suggestion_search
-        else:
-            for suggestion in self.suggestion_search:
-                # Test each suggestion to see if it contains all
-                # the words in current_search
-                if all(word in suggestion for word in current_search):
-                    temporary_suggestions.append(suggestion)
-
-        self.suggestion_label.update_suggestions(temporary_suggestions)
+        # Gets the text in the current entry box and starts a search for
+        # suggestions that contain all of its words.  Values that have been
+        # entered alongside the values in the other entry boxes come first,
+        # then the most common ones.  If entry box is empty the most common
+        # suggestions are returned.
+        self.cancel_suggestion_search()
+        current_search = self.entry_rows[self.currentEntryField].entry.get()
+        record_values = [row.entry.get() for row in self.entry_rows]
+        self.suggestion_steps = self.suggestion_engine.\
+            suggest_steps(current_search, self.currentEntryField,
+                          record_values)
+        self.suggestion_search_start = time.perf_counter()
+        self.run_suggestion_slice()
+
+    # Run the suggestion search until it finishes or its slice of time is
+    # used up, in which case the rest is run after Tk has handled any
+    # waiting events.  Results found along the way are shown straight away.
+    def run_suggestion_slice(self):
+        self.suggestion_slice_pending = None
+        slice_end = time.perf_counter() + self.suggestion_slice
+        try:
+            while True:
+                partial_suggestions = next(self.suggestion_steps)
+                if partial_suggestions is not None:
+                    self.suggestion_label.update_suggestions(
+                        partial_suggestions)
+                if time.perf_counter() > slice_end:
+                    break
+        except StopIteration as finished:
+            self.suggestion_steps = None
+            self.suggestion_label.update_suggestions(finished.value)
+            if self.telemetry.enabled:
+                self.telemetry.record(
+                    'suggestion search',
+                    time.perf_counter() - self.suggestion_search_start)
+            return
+        self.suggestion_slice_pending = self.after(1,
+                                                   self.run_suggestion_slice)
+
+    # Run the rest of a suggestion search straight away
+    def finish_suggestion_search(self):
+        if self.suggestion_slice_pending is not None:
+            self.after_cancel(self.suggestion_slice_pending)
+            self.suggestion_slice_pending = None
+        steps = self.suggestion_steps
+        self.suggestion_steps = None
+        self.suggestion_label.update_suggestions(run_steps(steps))
+
+    # Drop a suggestion search that hasn't finished
+    def cancel_suggestion_search(self):
+        if self.suggestion_slice_pending is not None:
+            self.after_cancel(self.suggestion_slice_pending)
+            self.suggestion_slice_pending = None
+        if self.suggestion_steps is not None:
+            self.suggestion_steps.close()
+            self.suggestion_steps = None
 
     # Move focus to another Entry box by supplying an offset.  This is done in
     # a circular fashion through number of entry boxes
@@ -320,7 +638,8 @@ class MainApplication(tkinter.ttk.Frame):
     def entry_focus_in(self, event, row_number):
         self.currentEntryField = row_number
         self.entry_rows[row_number].active(True)
-        self.refresh_suggestions()
+        self.request_suggestion_refresh()
+        self.show_field_region(row_number)
         self.suggestion_frame.place(relx=0,
                                     rely=1,
                                     relwidth=1,
@@ -362,67 +681,244 @@ class MainApplication(tkinter.ttk.Frame):
     def ignore_press(self, event):
         return 'break'
 
+    def next_incomplete_pressed(self, event):
+        self.go_to_incomplete(1)
+        return 'break'
+
+    def previous_incomplete_pressed(self, event):
+        self.go_to_incomplete(-1)
+        return 'break'
+
+    # Ask for a record number, as shown in the status, or the start of a file
+    # name and go to that record
+    def go_to_pressed(self, event):
+        text = tkinter.simpledialog.askstring(
+            "Go to", "Record number or file name", parent=self.parent)
+        if not text:
+            return 'break'
+        text = text.strip()
+        if text.isdigit():
+            record_number = int(text) - 1
+            if not 0 <= record_number < self.numberOfRecords:
+                record_number = None
+        else:
+            record_number = self.recordList.find_file_name(text)
+        if record_number is None:
+            self.status_label.configure(text="No record " + text)
+        else:
+            self.go_to_record(record_number)
+        return 'break'
+
+    # Go to the nearest record in a direction that doesn't have every field
+    # filled in.  Records that have just been saved are written first so
+    # they are counted.
+    def go_to_incomplete(self, direction):
+        self.result_writer.flush()
+        record_number = self.completion.find_incomplete(self.currentRecord,
+                                                        direction)
+        if record_number is None:
+            self.status_label.configure(
+                text="Every other record is complete")
+            return
+        self.go_to_record(record_number)
+
     # Take the values from the entry boxes and write them to the database
+    @timed('save_current_entries')
     def save_current_entries(self):
-        for index, row in enumerate(self.entry_rows):
-            file_name = self.recordList[self.currentRecord]
-            record = (file_name, str(index), row.entry.get())
-            self.db_connection.execute(
-                "INSERT OR REPLACE INTO RESULTS values (?, ?, ?)", record)
-            self.db_connection.commit()
+        # A search that is still running would see the counts change
+        self.cancel_suggestion_search()
+        file_name = self.recordList[self.currentRecord]
+        new_values = [row.entry.get() for row in self.entry_rows]
+
+        # In work queue mode a record can only be saved by the operator that
+        # leased it.  The lease is given up when the record is written, and
+        # the record is only finished for everyone once every field has a
+        # value, the same as in the completion index.
+        statements = []
+        if self.record_leases is not None:
+            if self.leased_record != self.currentRecord:
+                new_values = None
+            else:
+                statements.append(self.record_leases.release_statement(
+                    self.currentRecord, all(new_values)))
+                self.leased_record = None
+
+        if new_values is not None:
+            statements.append(self.completion.update_statement(
+                self.currentRecord, new_values))
+            self.result_writer.write(file_name, new_values, statements)
+
+            # Replace the counts of the old values with the new ones
+            self.learn(self.suggestion_engine.record_saved,
+                       self.record_values,
+                       new_values)
+            self.record_values = new_values
 
         # Clear the entry boxes
-        for row in self.entry_rows:
-            row.clear()
+        with self.suggestions_suspended():
+            for row in self.entry_rows:
+                row.clear()
 
     # Changes the currently displayed record by an offset
     def change_record(self, offset):
+        # In work queue mode move to the next record in that direction that
+        # nobody else has.  The next record is leased before the current one
+        # is given up, and if there isn't one the current record stays.
+        if self.record_leases is not None:
+            self.show_claimed_record(self.record_leases.claim(
+                self.currentRecord, offset, self.numberOfRecords))
+            return
+
         self.save_current_entries()
         self.currentRecord += offset
         self.currentRecord %= self.numberOfRecords
         self.display_record()
 
+    # Save the current record and show another.  In work queue mode, if the
+    # record is taken the next one after it that is free is shown instead.
+    def go_to_record(self, record_number):
+        if self.record_leases is not None:
+            self.show_claimed_record(self.record_leases.claim(
+                record_number - 1, 1, self.numberOfRecords))
+            return
+
+        self.save_current_entries()
+        self.currentRecord = record_number
+        self.display_record()
+
+    # Show a record that has just been leased.  If no record could be leased
+    # the current one stays.  The current record can be claimed again, for
+    # example by going to it with Ctrl+G, in which case nothing changes;
+    # saving it would give up the lease that was just renewed.
+    def show_claimed_record(self, next_record):
+        if next_record is None:
+            self.status_label.configure(
+                text="No other records are available")
+            self.parent.bind("<Tab>", self.tab_pressed)
+            return
+        if next_record == self.currentRecord:
+            return
+        self.save_current_entries()
+        self.currentRecord = next_record
+        self.leased_record = next_record
+        self.display_record()
+
+    # Write a snapshot of the suggestion counts that have just been worked
+    # out from the database, on a worker thread so the window opens straight
+    # away.  The counts mustn't change while they are being written, so
+    # anything learnt in the meantime is held back until the snapshot is
+    # done.
+    def start_snapshot_write(self):
+        self.held_back_learning = []
+        self.snapshot_future = self.snapshot_executor.submit(
+            self.suggestion_engine.write_snapshot,
+            snapshot_file_name(DATABASE_NAME), *self.database_version)
+        self.after(self.snapshot_poll_delay, self.finish_snapshot_write)
+
+    def finish_snapshot_write(self):
+        if not self.snapshot_future.done():
+            self.after(self.snapshot_poll_delay, self.finish_snapshot_write)
+            return
+        error = self.snapshot_future.exception()
+        if error is not None:
+            self.status_label.configure(
+                text="Couldn't save the suggestion snapshot: " + str(error))
+        held_back_learning = self.held_back_learning
+        self.held_back_learning = None
+        if len(held_back_learning) == 0:
+            return
+
+        # As in poll_operators, a search that is still running would see the
+        # counts change, so it is started again afterwards
+        searching = self.suggestion_steps is not None
+        self.cancel_suggestion_search()
+        for method, arguments in held_back_learning:
+            method(*arguments)
+        if searching:
+            self.request_suggestion_refresh()
+
+    # Pass something learnt to the suggestion engine, or hold it back while
+    # a snapshot is being written
+    def learn(self, method, *arguments):
+        if self.held_back_learning is not None:
+            self.held_back_learning.append((method, arguments))
+        else:
+            method(*arguments)
+
+    # Keep the lease on the current record and learn from the values that
+    # other operators have entered since the last time this was called
+    def poll_operators(self):
+        # A search that is still running would see the counts change, so it
+        # is started again afterwards
+        searching = self.suggestion_steps is not None
+        self.cancel_suggestion_search()
+        if self.leased_record is not None:
+            self.record_leases.renew(self.leased_record)
+        self.last_change, changes = read_changes(self.db_connection,
+                                                 self.last_change,
+                                                 self.operator)
+        for field, old_value, new_value in changes:
+            self.learn(self.suggestion_engine.attribute_changed,
+                       field,
+                       old_value,
+                       new_value)
+        if searching:
+            self.request_suggestion_refresh()
+        self.after(self.poll_delay, self.poll_operators)
+
     # load a new record from file and database
+    @timed('display_record')
     def display_record(self):
         image_error_string = ''
         attribute_error_string = ''
 
         # Attempt to load each file as an image. If it isn't an image of pure
-        # red colour is used
+        # red colour is used.  The image has usually been decoded already by
+        # the prefetcher.
+        scaled_image = None
         try:
-            self.image = Image.open("".
-                                    join(self.directoryName +
-                                         "/" +
-                                         self.recordList[self.currentRecord]))
-        except OSError as e:
+            with self.telemetry.timer('display_record image'):
+                cached_image = self.image_prefetcher.get(
+                    self.record_path(self.currentRecord),
+                    self.image_frame_size(),
+                    self.image_aspect_locked)
+            self.cached_image = cached_image
+            self.image = cached_image.image
+            scaled_image = cached_image.scaled_for(self.image_frame_size())
+            self.tile_view.set_image(self.record_path(self.currentRecord),
+                                     cached_image.original_size,
+                                     self.image)
+        except (OSError, Image.DecompressionBombError) as e:
             image_error_string = "\nNot a recognised image file"
+            self.cached_image = None
             self.image = Image.new("RGB", (512, 512), "red")
+            self.tile_view.set_image(None, None, None)
 
-        # Get the attributes associated with a particular record
+        # Get the attributes associated with a particular record.  If the
+        # record was only just saved make sure it has been written first.
         file_name = self.recordList[self.currentRecord]
-        cursor = self.db_connection.execute('''SELECT ATTRIBUTE_NUMBER,
-                                            ATTRIBUTE from RESULTS
-                                            where FILE_NAME=?''', (file_name,))
+        if self.result_writer.is_pending(file_name):
+            self.result_writer.flush()
+        with self.telemetry.timer('display_record attributes'):
+            cursor = self.db_connection.execute('''SELECT ATTRIBUTE_NUMBER,
+                                                ATTRIBUTE from RESULTS
+                                                where FILE_NAME=?''',
+                                                (file_name,))
+            attributes = cursor.fetchall()
 
         # Load the attributes into the entry boxes.  If there are not enough
         # entry boxes, show an error message.
-        for attribute in cursor:
-            try:
-                self.entry_rows[attribute[0]].set(attribute[1])
-            except IndexError as e:
-                attribute_error_string = ''.join("\nRecord has more than " +
-                                                 str(self.numberOfEntryFields) +
-                                                 " attributes")
-
-        # Get all possible attributes values from the database.  These are
-        # returned in descending order of how often they appear in the database
-        cursor = self.db_connection.execute('''SELECT ATTRIBUTE from
-                                            RESULTS GROUP BY ATTRIBUTE
-                                            ORDER BY COUNT(ATTRIBUTE) DESC''')
-
-        # Turn cursor into a list, ignoring empty ('') attributes
-        self.suggestion_search = [i[0] for i in cursor.fetchall()]
-        self.suggestion_search = [i for i in self.suggestion_search if i != '']
+        self.record_values = [None] * self.numberOfEntryFields
+        with self.suggestions_suspended():
+            for attribute in attributes:
+                try:
+                    self.entry_rows[attribute[0]].set(attribute[1])
+                    self.record_values[attribute[0]] = attribute[1]
+                except IndexError as e:
+                    attribute_error_string = ''.join(
+                        "\nRecord has more than " +
+                        str(self.numberOfEntryFields) +
+                        " attributes")
 
         # Construct a status string and display it
         status_string = ''.join('File name: ' +
@@ -433,10 +929,34 @@ class MainApplication(tkinter.ttk.Frame):
                                 str(self.numberOfRecords) +
                                 image_error_string +
                                 attribute_error_string)
+        if self.record_leases is not None and \
+                self.leased_record != self.currentRecord:
+            status_string += "\nLeased by another operator, not saved"
+
+        # Offer to fill in the record from a near duplicate image
+        self.similar_values = None
+        if not all(self.record_values):
+            with self.telemetry.timer('display_record similar'):
+                similar = self.find_similar_record(file_name)
+            if similar is not None:
+                similar_file_name, self.similar_values = similar
+                status_string += ''.join("\nSimilar to " +
+                                         similar_file_name +
+                                         ", Ctrl+D to fill in")
+
         self.status_label.configure(text=status_string)
 
         # Update the image with a high quality version
-        self.refresh_image(1)
+        if scaled_image is not None:
+            self.show_image(scaled_image)
+        else:
+            self.refresh_image(1)
+
+        # Zoom to the part of the image for the current entry box
+        self.show_field_region(self.currentEntryField)
+
+        # Start decoding the records that are likely to be shown next
+        self.prefetch_images()
 
         # Move focus to the first entry box
         if self.rehome_entry_focus:
@@ -445,6 +965,34 @@ class MainApplication(tkinter.ttk.Frame):
         # Reactivate the tab key
         self.parent.bind("<Tab>", self.tab_pressed)
 
+    # Return the file name and values of the closest record with values
+    # whose image is a near duplicate of a file's, or None if there isn't one
+    def find_similar_record(self, file_name, max_checked=20):
+        matches = self.image_hashes.similar(file_name, limit=max_checked)
+        for distance, similar_file_name in matches:
+            if self.result_writer.is_pending(similar_file_name):
+                self.result_writer.flush()
+            values = [None] * self.numberOfEntryFields
+            for attribute_number, attribute in self.db_connection.execute(
+                    '''SELECT ATTRIBUTE_NUMBER, ATTRIBUTE from RESULTS
+                    where FILE_NAME=?''', (similar_file_name,)):
+                if 0 <= attribute_number < self.numberOfEntryFields:
+                    values[attribute_number] = attribute
+            if any(values):
+                return similar_file_name, values
+        return None
+
+    # Copy the values of the similar record into the entry boxes that are
+    # empty.  Nothing is saved until the record is changed as usual.
+    def fill_from_similar(self, event):
+        if self.similar_values is None:
+            return 'break'
+        with self.suggestions_suspended():
+            for row, value in zip(self.entry_rows, self.similar_values):
+                if value and not row.entry.get():
+                    row.set(value)
+        return 'break'
+
     # When the image frame is re-sized, change
     # the size of the label that contains the image
     def image_frame_resize(self, event):
@@ -470,45 +1018,441 @@ class MainApplication(tkinter.ttk.Frame):
 
     # Resize the image and display it. Aspect can be locked. Quality can be
     # high or low
+    @timed('refresh_image')
     def refresh_image(self, quality):
-            try:
-                image_width, image_height = self.image.size
-                frame_width = self.image_frame.winfo_width()
-                frame_height = self.image_frame.winfo_height()
-
-                if self.image_aspect_locked:
-                    width_ratio = image_width / frame_width
-                    height_ratio = image_height / frame_height
-                    resize_ratio = max(width_ratio, height_ratio)
-                    new_width = int(image_width/resize_ratio)
-                    new_height = int(image_height/resize_ratio)
-                else:
-                    new_width = frame_width
-                    new_height = frame_height
-
-                if quality == 1:
-                    image2 = self.image.resize((new_width, new_height),
-                                               Image.ANTIALIAS)
-                else:
-                    image2 = self.image.resize((new_width, new_height))
-
-                self.photo = ImageTk.PhotoImage(image2)
-                self.image_label.configure(image=self.photo, anchor="center")
-                self.image_label.configure(background="white")
-
-            except AttributeError:
-                pass
+        try:
+            frame_size = self.image_frame_size()
+
+            # A reduced copy of the image from the pyramid may not have enough
+            # pixels once the frame has grown, so load a bigger one
+            if quality == 1 and self.cached_image is not None and \
+                    self.cached_image.too_small_for(frame_size,
+                                                    self.image_aspect_locked):
+                self.cached_image = self.image_prefetcher.reload(
+                    self.record_path(self.currentRecord),
+                    frame_size,
+                    self.image_aspect_locked)
+                self.image = self.cached_image.image
+
+            # When zoomed in only the part of the image that can be seen is
+            # drawn
+            if self.tile_view.zoomed():
+                self.show_image(self.tile_view.render(frame_size, quality))
+                if self.tile_view.is_building() and \
+                        self.tile_poll_pending is None:
+                    self.tile_poll_pending = self.after(self.tile_poll_delay,
+                                                        self.poll_tiles)
+                return
+
+            new_size = fit_size(self.image.size,
+                                frame_size,
+                                self.image_aspect_locked)
+
+            if quality == 1:
+                image2 = self.image.resize(new_size, Image.LANCZOS)
+            else:
+                image2 = self.image.resize(new_size)
+
+            self.show_image(image2)
+
+        except AttributeError:
+            pass
+
+    # Draw the image again once Tk is idle, quickly at first and then in
+    # high quality once the view has stopped moving.  Several requests before
+    # then only cause one redraw.
+    def request_image_refresh(self):
+        if self.image_refresh_pending is None:
+            self.image_refresh_pending = self.after_idle(
+                self.run_image_refresh)
+
+    def run_image_refresh(self):
+        self.image_refresh_pending = None
+        self.after_cancel(self.refreshTimer)
+        self.refreshTimer = self.after(self.zoom_refresh_delay,
+                                       self.refresh_image,
+                                       1)
+        self.refresh_image(0)
+
+    # Draw the view again once the tiles being cut for it are ready
+    def poll_tiles(self):
+        self.tile_poll_pending = None
+        if self.tile_view.is_building():
+            self.tile_poll_pending = self.after(self.tile_poll_delay,
+                                                self.poll_tiles)
+        else:
+            self.refresh_image(1)
+
+    def image_wheel(self, event):
+        if event.num == 5 or event.delta < 0:
+            factor = 1 / self.zoom_step
+        else:
+            factor = self.zoom_step
+        self.tile_view.zoom_by(factor, self.image_frame_size(),
+                               (event.x, event.y))
+        self.request_image_refresh()
+
+    def zoom_in_pressed(self, event):
+        self.tile_view.zoom_by(self.zoom_step, self.image_frame_size())
+        self.request_image_refresh()
+        return 'break'
+
+    def zoom_out_pressed(self, event):
+        self.tile_view.zoom_by(1 / self.zoom_step, self.image_frame_size())
+        self.request_image_refresh()
+        return 'break'
+
+    def image_drag_start(self, event):
+        self.drag_position = (event.x, event.y)
+
+    def image_drag(self, event):
+        if self.drag_position is None:
+            return
+        self.tile_view.pan(event.x - self.drag_position[0],
+                           event.y - self.drag_position[1])
+        self.drag_position = (event.x, event.y)
+        self.request_image_refresh()
+
+    # Zoom to the part of the image saved for an entry box.  If the box has
+    # none and the image was zoomed to another box's part, the whole image is
+    # shown again.
+    def show_field_region(self, field):
+        region = self.field_regions.get(field)
+        if region is not None:
+            self.tile_view.show_region(region, self.image_frame_size())
+        elif self.tile_view.automatic:
+            self.tile_view.fit()
+        else:
+            return
+        self.request_image_refresh()
+
+    # Remember the part of the image being shown for the current entry box.
+    # If the whole image is shown the box's part is forgotten.
+    def remember_region(self, event):
+        if self.tile_view.path is None:
+            return 'break'
+        region = self.tile_view.region(self.image_frame_size())
+        self.field_regions.set(self.currentEntryField, region)
+        self.tile_view.automatic = region is not None
+        if region is None:
+            message = "Image region cleared for box "
+        else:
+            message = "Image region saved for box "
+        self.status_label.configure(
+            text=message + str(self.currentEntryField + 1))
+        return 'break'
+
+    # Display an image that has already been scaled to fit the image frame
+    def show_image(self, image):
+        self.photo = ImageTk.PhotoImage(image)
+        self.image_label.configure(image=self.photo, anchor="center")
+        self.image_label.configure(background="white")
+
+    # Return the width and height of the image frame
+    def image_frame_size(self):
+        return self.image_frame.winfo_width(), self.image_frame.winfo_height()
+
+    # Show or hide the timing histograms over the image
+    def toggle_telemetry(self, event):
+        self.telemetry_shown = not self.telemetry_shown
+        if self.telemetry_shown:
+            self.telemetry_label.place(x=0, y=0)
+            self.telemetry_label.lift()
+            self.show_telemetry()
+        else:
+            self.telemetry_label.place_forget()
+
+    # Refresh the timing histograms every second while they are shown
+    def show_telemetry(self):
+        if not self.telemetry_shown:
+            return
+        if self.telemetry.enabled:
+            lines = self.telemetry.report() + self.image_cache_report()
+        else:
+            lines = ["Start with --telemetry to record timings"]
+        self.telemetry_label.configure(text="\n".join(lines))
+        self.after(1000, self.show_telemetry)
+
+    # Describe how well the image cache is working
+    def image_cache_report(self):
+        lines = []
+        for name, cache in (('image cache', self.image_prefetcher.cache),
+                            ('tile cache', self.tile_view.cache)):
+            statistics = cache.statistics()
+            lines.append('%-24s %6d hits  %6d misses  %6d evictions  '
+                         '%6.1f MB' %
+                         (name,
+                          statistics['hits'],
+                          statistics['misses'],
+                          statistics['evictions'],
+                          statistics['bytes'] / (1024 * 1024)))
+        return lines
+
+    # Write the timing histograms to the log every so often
+    def write_telemetry(self):
+        self.telemetry.write_report(self.image_cache_report())
+        self.after(self.telemetry_delay, self.write_telemetry)
+
+    # Turn the profiler on or off and show what happened in the status label
+    def toggle_profiler(self, event):
+        self.status_label.configure(text=self.telemetry.toggle_profiler())
+
+    # Start looking for files that have appeared in the image directory
+    def rescan_records(self):
+        self.rescan_future = self.rescan_executor.submit(
+            rescan_manifest, self.recordList.recursive)
+        self.after(self.rescan_poll_delay, self.finish_rescan)
+
+    # Once the scan is done, add the new files to the end of the list of
+    # records
+    def finish_rescan(self):
+        if not self.rescan_future.done():
+            self.after(self.rescan_poll_delay, self.finish_rescan)
+            return
+        error = self.rescan_future.exception()
+        if error is not None:
+            self.status_label.configure(
+                text="Couldn't look for new files: " + str(error))
+        self.recordList.count_records()
+        self.numberOfRecords = len(self.recordList)
+        self.completion.add_new_records()
+        self.after(self.rescan_delay, self.rescan_records)
+
+    # Return the path of the file for a record
+    def record_path(self, record_number):
+        return "".join(self.directoryName +
+                       "/" +
+                       self.recordList[record_number])
+
+    # Queue the records around the current one to be decoded in the
+    # background, nearest first
+    def prefetch_images(self):
+        offsets = []
+        for distance in range(1, max(self.prefetch_next,
+                                     self.prefetch_previous) + 1):
+            if distance <= self.prefetch_next:
+                offsets.append(distance)
+            if distance <= self.prefetch_previous:
+                offsets.append(-distance)
+        paths = []
+        for offset in offsets:
+            record_number = self.currentRecord + offset
+            record_number %= self.numberOfRecords
+            if record_number != self.currentRecord:
+                paths.append(self.record_path(record_number))
+        self.image_prefetcher.prefetch(paths,
+                                       self.image_frame_size(),
+                                       self.image_aspect_locked)
 
 
 # Manage closing the program cleanly
 def close_program(root_window, frame):
     frame.save_current_entries()
+    frame.result_writer.close()
+    frame.image_prefetcher.close()
+    frame.tile_view.close()
+    frame.rescan_executor.shutdown(wait=True)
+    frame.snapshot_executor.shutdown(wait=True)
+    frame.telemetry.write_report(frame.image_cache_report())
+    if change_counter(frame.db_connection) != frame.database_version:
+        start_snapshot_rebuild()
 
     # Destroy needs to be explicitly called
     root_window.destroy()
 
-if __name__ == "__main__":
+# Build the image pyramids for every record ahead of time
+def build_pyramid_command(arguments):
+    paths = ["".join(IMAGE_DIRECTORY + "/" + file_name)
+             for file_name in open_manifest(arguments.recursive)]
+    built, present, failed = build_pyramids(pyramid_directory(DATABASE_NAME),
+                                            paths,
+                                            arguments.workers,
+                                            arguments.tiles)
+    print(str(built) + " built, " +
+          str(present) + " already built, " +
+          str(failed) + " not images")
+
+
+# Hash every image so that near duplicates can be found.  Only files that
+# are new or have changed since the last time are hashed.
+def hash_images_command(arguments):
+    manifest = open_manifest(arguments.recursive)
+    hashed, unchanged, failed = ImageHashes(manifest.db_connection).update(
+        IMAGE_DIRECTORY, list(manifest), arguments.workers)
+    print(str(hashed) + " hashed, " +
+          str(unchanged) + " unchanged, " +
+          str(failed) + " not images")
+
+
+# Look for new files in the image directory
+def scan_command(arguments):
+    manifest = open_manifest(arguments.recursive)
+    CompletionIndex(manifest.db_connection,
+                    NUMBER_OF_FIELDS).add_new_records()
+    print(str(len(manifest)) + " records")
+
+
+# Save the suggestion counts to a snapshot so the program starts quickly
+def snapshot_command(arguments):
+    db_connection = open_database()
+    suggestion_engine = SuggestionEngine()
+    db_connection.execute('BEGIN')
+    identity, version = change_counter(db_connection)
+    suggestion_engine.load(db_connection)
+    db_connection.commit()
+    file_name = snapshot_file_name(DATABASE_NAME)
+    if suggestion_engine.write_snapshot(file_name, identity, version):
+        print("snapshot of version " + str(version) + " written to " +
+              file_name)
+    else:
+        print(file_name + " is in use and wasn't replaced")
+
+
+# Load results or a seed vocabulary from a file
+def import_command(arguments):
+    db_connection = open_database()
+    import_results(db_connection,
+                   arguments.file,
+                   arguments.format,
+                   arguments.seed,
+                   arguments.batch_size)
+
+    # Count the fields filled in for the records that were loaded.  The
+    # manifest is opened so its table exists even if it was never scanned.
+    RecordManifest(db_connection, IMAGE_DIRECTORY)
+    CompletionIndex(db_connection, NUMBER_OF_FIELDS).recount()
+
+
+# Write the results to a file with one row for each record
+def export_command(arguments):
+    try:
+        export_results(open_database(),
+                       arguments.file,
+                       arguments.format,
+                       arguments.include_seed)
+    except ValueError as e:
+        sys.exit("Can't export " + arguments.file + ": " + str(e))
+
+
+# The ways of ranking suggestions that can be given with --ranking
+RANKING_NAMES = {'field': FIELD_RANKING,
+                 'field-only': FIELD_ONLY_RANKING,
+                 'global': GLOBAL_RANKING}
+
+
+# Read a --ranking argument, either a ranking for every entry box or
+# BOX=RANKING for one box, numbered from 1.  Returns (field, ranking) with a
+# field of None for every box.
+def parse_ranking(text):
+    box, _equals, name = text.rpartition('=')
+    if name not in RANKING_NAMES:
+        raise argparse.ArgumentTypeError(
+            "ranking must be one of " + ", ".join(sorted(RANKING_NAMES)))
+    if not box:
+        return None, RANKING_NAMES[name]
+    if not box.isdigit() or not 1 <= int(box) <= NUMBER_OF_FIELDS:
+        raise argparse.ArgumentTypeError(
+            "entry box must be from 1 to " + str(NUMBER_OF_FIELDS))
+    return int(box) - 1, RANKING_NAMES[name]
+
+
+# Start the data entry window
+def run_application(arguments):
     root = tkinter.Tk()
-    main_frame = MainApplication(root)
+    main_frame = MainApplication(root,
+                                 arguments.recursive,
+                                 arguments.operator,
+                                 arguments.telemetry,
+                                 arguments.fuzzy,
+                                 dict(arguments.ranking))
     root.protocol("WM_DELETE_WINDOW", lambda: close_program(root, main_frame))
     root.mainloop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Computer assisted human based data entry")
+    parser.add_argument('--recursive', action='store_true',
+                        help="include files in subdirectories")
+    parser.add_argument('--operator',
+                        help="share the records with other operators, "
+                             "working as this operator")
+    parser.add_argument('--telemetry', action='store_true',
+                        help="record how long each part of the program "
+                             "takes")
+    parser.add_argument('--fuzzy', action='store_true',
+                        help="also suggest values with words that are "
+                             "close to the ones typed")
+    parser.add_argument('--ranking', type=parse_ranking, action='append',
+                        default=[], metavar='[BOX=]RANKING',
+                        help="how suggestions are ranked, for every entry "
+                             "box or one box numbered from 1: field (values "
+                             "from the same box first), field-only or "
+                             "global.  Can be given more than once.")
+    parser.set_defaults(command=run_application)
+    subparsers = parser.add_subparsers()
+
+    scan_parser = subparsers.add_parser(
+        'scan',
+        help="add new files in the image directory to the list of records")
+    scan_parser.add_argument('--recursive', action='store_true',
+                             default=argparse.SUPPRESS,
+                             help="include files in subdirectories")
+    scan_parser.set_defaults(command=scan_command)
+
+    pyramid_parser = subparsers.add_parser(
+        'build-pyramid',
+        help="make reduced copies of every image ahead of time")
+    pyramid_parser.add_argument('--recursive', action='store_true',
+                                default=argparse.SUPPRESS,
+                                help="include files in subdirectories")
+    pyramid_parser.add_argument('--workers', type=int, default=None,
+                                help="number of processes to use")
+    pyramid_parser.add_argument('--tiles', action='store_true',
+                                help="also cut every level into tiles so "
+                                     "zooming in is quick straight away")
+    pyramid_parser.set_defaults(command=build_pyramid_command)
+
+    hash_parser = subparsers.add_parser(
+        'hash-images',
+        help="hash every image so near duplicates can be filled in")
+    hash_parser.add_argument('--recursive', action='store_true',
+                             default=argparse.SUPPRESS,
+                             help="include files in subdirectories")
+    hash_parser.add_argument('--workers', type=int, default=None,
+                             help="number of processes to use")
+    hash_parser.set_defaults(command=hash_images_command)
+
+    snapshot_parser = subparsers.add_parser(
+        'snapshot',
+        help="save the suggestion counts so the program starts quickly")
+    snapshot_parser.set_defaults(command=snapshot_command)
+
+    import_parser = subparsers.add_parser(
+        'import',
+        help="load results, or a seed vocabulary to train the suggestions, "
+             "from a CSV, JSON lines or text file")
+    import_parser.add_argument('file', help="file to read, - for stdin")
+    import_parser.add_argument('--format', choices=['csv', 'jsonl', 'text'],
+                               help="file format, guessed from the extension "
+                                    "if not given")
+    import_parser.add_argument('--seed', action='store_true',
+                               help="the file is a list of ATTRIBUTE values "
+                                    "with optional ATTRIBUTE_NUMBER and COUNT")
+    import_parser.add_argument('--batch-size', type=int, default=50000,
+                               help="rows inserted at a time")
+    import_parser.set_defaults(command=import_command)
+
+    export_parser = subparsers.add_parser(
+        'export',
+        help="write the results with one row for each file name")
+    export_parser.add_argument('file', help="file to write, - for stdout")
+    export_parser.add_argument('--format', choices=['csv', 'jsonl'],
+                               help="file format, guessed from the extension "
+                                    "if not given")
+    export_parser.add_argument('--include-seed', action='store_true',
+                               help="include the records made from seed "
+                                    "vocabularies")
+    export_parser.set_defaults(command=export_command)
+
+    parsed_arguments = parser.parse_args()
+    parsed_arguments.command(parsed_arguments)
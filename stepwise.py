@@ -0,0 +1,26 @@
+# Searches that can take a long time are written as generators so they can
+# be run a slice at a time on the Tk event loop, letting keystrokes through
+# in between, and dropped as soon as they are no longer wanted.  A search
+# yields None whenever it can be paused, or a list of the results it has
+# found so far if they are worth showing, and returns its final result.
+# Searches made of smaller searches run them with yield from.
+#
+# A search pauses after checking about STEP_SIZE candidates.
+STEP_SIZE = 1000
+
+
+# Run a search to the end and return its result
+def run_steps(steps):
+    try:
+        while True:
+            next(steps)
+    except StopIteration as finished:
+        return finished.value
+
+
+# Return chunks of a sequence, each STEP_SIZE long except the last
+def chunks(sequence, length=None):
+    if length is None:
+        length = len(sequence)
+    for start in range(0, length, STEP_SIZE):
+        yield sequence[start:min(start + STEP_SIZE, length)]
@@ -0,0 +1,877 @@
+import array
+import heapq
+import itertools
+import operator
+from collections import defaultdict
+from fuzzy_index import SymSpellIndex
+from index_snapshot import SnapshotWriter, open_snapshot
+from stepwise import STEP_SIZE, run_steps, chunks
+from vocabulary import Vocabulary
+
+
+# An inverted index used to find suggestions that contain every word typed
+# into an entry box.  Every substring of a suggestion up to gram_length
+# characters long is indexed.  Each gram maps to a posting list holding the
+# ids of the suggestions that contain it.  Ids are handed out in the order the
+# suggestions are first seen, which is descending frequency when the index is
+# built in one go, so the posting lists start out in frequency order.
+#
+# Each suggestion carries a count.  Suggestions are ranked by descending count
+# and then alphabetically.  A suggestion whose count drops to zero keeps its id
+# and postings but is no longer offered.
+#
+# The suggestions are kept in a Vocabulary, and the counts, ranked list and
+# posting lists are arrays of numbers rather than lists of int objects.
+# Searches work with ids and only the suggestions returned are made into
+# strings.
+class SuggestionIndex:
+    def __init__(self, gram_length=3):
+        self.gram_length = gram_length
+        self.vocabulary = Vocabulary()
+        self.counts = array.array('q')
+        self.postings = {}
+
+        # Ids of all suggestions with a positive count in rank order
+        self.ranked = array.array('q')
+
+    def __len__(self):
+        return len(self.ranked)
+
+    # Rebuild the index from (suggestion, count) pairs
+    def build(self, value_counts):
+        self.vocabulary = Vocabulary()
+        self.counts = array.array('q')
+        postings = defaultdict(new_posting)
+        value_counts = [(value, count) for value, count in value_counts
+                        if value and count > 0]
+        value_counts.sort(key=lambda pair: (-pair[1], pair[0]))
+        for value, count in value_counts:
+            value_id = self.vocabulary.add(value)
+            self.counts.append(count)
+            for gram in self.value_grams(value):
+                postings[gram].append(value_id)
+        self.postings = dict(postings)
+        self.ranked = array.array('q', range(0, len(self.vocabulary)))
+
+    # Add the index to a snapshot.  The names of its sections start with
+    # prefix.
+    def write_snapshot(self, writer, prefix):
+        self.vocabulary.write_snapshot(writer, prefix)
+        writer.add_array(prefix + 'counts', 'q', self.counts)
+        writer.add_array(prefix + 'ranked', 'q', self.ranked)
+        grams = list(self.postings)
+        offsets = [0]
+        for gram in grams:
+            offsets.append(offsets[-1] + len(self.postings[gram]))
+        writer.add_strings(prefix + 'grams', grams)
+        writer.add_array(prefix + 'posting_offsets', 'q', offsets)
+        writer.add_array(prefix + 'postings', 'I',
+                         itertools.chain.from_iterable(
+                             self.postings[gram] for gram in grams))
+
+    # Replace the index with one saved in a snapshot.  The vocabulary,
+    # counts and ranked list are copied, as they change whenever a suggestion
+    # is added, but the posting lists are used where they are in the
+    # snapshot.
+    def load_snapshot(self, snapshot, prefix):
+        self.vocabulary.load_snapshot(snapshot, prefix)
+        self.counts = snapshot.copy_array(prefix + 'counts', 'q')
+        self.ranked = snapshot.copy_array(prefix + 'ranked', 'q')
+        self.postings = SnapshotPostings(
+            snapshot.strings(prefix + 'grams'),
+            snapshot.array(prefix + 'posting_offsets', 'q'),
+            snapshot.array(prefix + 'postings', 'I'))
+
+    # Change the count of a suggestion by delta, adding it to the index if it
+    # hasn't been seen before
+    def add(self, value, delta=1):
+        if not value or delta == 0:
+            return
+        value_id = self.vocabulary.find(value)
+        if value_id is None:
+            if delta < 0:
+                return
+            value_id = self.vocabulary.add(value)
+            self.counts.append(0)
+            for gram in self.value_grams(value):
+                self.postings.setdefault(gram, new_posting()).append(value_id)
+
+        old_count = self.counts[value_id]
+        new_count = max(old_count + delta, 0)
+        if old_count > 0:
+            del self.ranked[self.rank_position(old_count, value)]
+        self.counts[value_id] = new_count
+        if new_count > 0:
+            self.ranked.insert(self.rank_position(new_count, value), value_id)
+
+    # Return the number of times a suggestion has been entered
+    def count(self, value):
+        value_id = self.vocabulary.find(value)
+        if value_id is None:
+            return 0
+        return self.counts[value_id]
+
+    # Return the sort key that orders suggestions by rank
+    def rank_key(self, value_id):
+        return -self.counts[value_id], self.vocabulary.key(value_id)
+
+    # Binary search the ranked list for the position of a suggestion with a
+    # given count
+    def rank_position(self, count, value):
+        key = (-count, value.encode('utf-8'))
+        low = 0
+        high = len(self.ranked)
+        while low < high:
+            middle = (low + high) // 2
+            if self.rank_key(self.ranked[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # Return the set of distinct grams that occur in a suggestion
+    def value_grams(self, value):
+        grams = set()
+        for length in range(1, self.gram_length + 1):
+            for start in range(0, len(value) - length + 1):
+                grams.add(value[start:start + length])
+        return grams
+
+    # Return the grams that must all be present in a suggestion for it to
+    # contain a word.  Short words are looked up directly.
+    def word_grams(self, word):
+        if len(word) <= self.gram_length:
+            return [word]
+        return [word[start:start + self.gram_length]
+                for start in range(0, len(word) - self.gram_length + 1)]
+
+    # Return up to limit suggestions, most frequent first, that contain all of
+    # the words in the list.  This gives the same result as testing every
+    # suggestion with all(word in suggestion for word in words).
+    def search(self, words, limit=3):
+        return run_steps(self.search_steps(words, limit))
+
+    # The same search, written as steps that can be run a slice at a time
+    def search_steps(self, words, limit=3):
+        if len(words) == 0:
+            return [self.vocabulary[i] for i in self.ranked[0:limit]]
+
+        # The shortest posting list for any gram of any word bounds the set of
+        # suggestions that can possibly match
+        shortest = None
+        for word in words:
+            for gram in self.word_grams(word):
+                posting = self.postings.get(gram)
+                if posting is None:
+                    return []
+                if shortest is None or len(posting) < len(shortest):
+                    shortest = posting
+
+        # When the candidates make up a large part of the vocabulary, walking
+        # the ranked list finds the best matches sooner than checking every
+        # candidate.  With several words far fewer suggestions may match than
+        # there are candidates, so the walk is given up after as many steps
+        # as there are candidates and they are checked instead.
+        encoded_words = [word.encode('utf-8') for word in words]
+        contains_all = self.vocabulary.contains_all
+        if len(shortest) * len(shortest) > limit * len(self.ranked):
+            results = []
+            for chunk in chunks(self.ranked,
+                                min(len(shortest), len(self.ranked))):
+                for value_id in chunk:
+                    if contains_all(value_id, encoded_words):
+                        results.append(value_id)
+                        if len(results) == limit:
+                            return [self.vocabulary[i] for i in results]
+                yield None
+            if len(shortest) >= len(self.ranked):
+                return [self.vocabulary[i] for i in results]
+
+        matches = []
+        for chunk in chunks(shortest):
+            matches.extend(value_id for value_id in chunk
+                           if self.counts[value_id] > 0 and
+                           contains_all(value_id, encoded_words))
+            yield None
+        return [self.vocabulary[i] for i in
+                heapq.nsmallest(limit, matches, key=self.rank_key)]
+
+
+# Return an empty posting list
+def new_posting():
+    return array.array('I')
+
+
+# The posting lists of a SuggestionIndex loaded from a snapshot.  The lists
+# are read straight from the mapped file, and a list is only copied into
+# memory when a suggestion is added to it.
+class SnapshotPostings:
+    def __init__(self, grams, offsets, postings):
+        self.grams = grams
+        self.gram_ids = dict(zip(grams, itertools.count()))
+        self.offsets = offsets
+        self.postings = postings
+        self.changed = {}
+
+    def __iter__(self):
+        yield from self.grams
+        for gram in self.changed:
+            if gram not in self.gram_ids:
+                yield gram
+
+    def __getitem__(self, gram):
+        posting = self.get(gram)
+        if posting is None:
+            raise KeyError(gram)
+        return posting
+
+    def get(self, gram, default=None):
+        posting = self.changed.get(gram)
+        if posting is not None:
+            return posting
+        gram_id = self.gram_ids.get(gram)
+        if gram_id is None:
+            return default
+        return self.postings[self.offsets[gram_id]:self.offsets[gram_id + 1]]
+
+    # Return a posting list that can be changed, copying it out of the
+    # snapshot the first time
+    def setdefault(self, gram, default):
+        posting = self.changed.get(gram)
+        if posting is None:
+            posting = self.get(gram)
+            posting = default if posting is None else \
+                array.array('I', posting)
+            self.changed[gram] = posting
+        return posting
+
+
+# Ways of ranking the suggestions offered for a field.  FIELD_RANKING offers
+# values previously entered in the same field followed by values from any
+# field.  FIELD_ONLY_RANKING only offers values from the same field and
+# GLOBAL_RANKING ranks values from all fields together.
+FIELD_RANKING = 'field'
+FIELD_ONLY_RANKING = 'field only'
+GLOBAL_RANKING = 'global'
+
+
+# Keeps count of how often each attribute value appears in the database, both
+# overall and for each attribute number.  The counts are read once and
+# afterwards kept up to date with the changes made when a record is saved,
+# rather than being recalculated from the database.
+#
+# If fuzzy matching is turned on, the words that make up the values are kept
+# in a SymSpellIndex.  When there aren't enough suggestions containing the
+# typed words exactly, words within a small edit distance of the typed ones
+# are tried as well, so a typo doesn't hide the value being typed.
+class FrequencyModel:
+    def __init__(self, default_ranking=FIELD_RANKING, fuzzy=False):
+        self.global_index = SuggestionIndex()
+        self.field_indexes = {}
+        self.default_ranking = default_ranking
+        self.field_ranking = {}
+        self.fuzzy_index = SymSpellIndex() if fuzzy else None
+
+        # Fuzzy matching is only used for words at least this long.  Words up
+        # to short_word_length long can only be one edit away.
+        self.fuzzy_minimum_length = 3
+        self.short_word_length = 4
+        self.fuzzy_alternatives = 3
+        self.fuzzy_searches = 10
+
+        # Checking the edit distance of every candidate is slow, and the
+        # earlier words of a value are looked up again on every keystroke, so
+        # the alternatives found for each word are kept until the counts
+        # change
+        self.alternatives_cache = {}
+        self.alternatives_cache_size = 1000
+
+    # Choose how suggestions are ranked for a particular field
+    def set_ranking(self, field, ranking):
+        self.field_ranking[field] = ranking
+
+    # Count every attribute value in the RESULTS table
+    def load(self, db_connection):
+        cursor = db_connection.execute('''SELECT ATTRIBUTE_NUMBER, ATTRIBUTE,
+                                       COUNT(ATTRIBUTE) from RESULTS
+                                       GROUP BY ATTRIBUTE_NUMBER, ATTRIBUTE''')
+        self.build(cursor)
+
+    # Build the indexes from (attribute number, value, count) rows
+    def build(self, field_value_counts):
+        global_counts = defaultdict(int)
+        field_counts = defaultdict(list)
+        for field, value, count in field_value_counts:
+            global_counts[value] += count
+            field_counts[field].append((value, count))
+
+        self.global_index.build(global_counts.items())
+        self.field_indexes = {}
+        for field, value_counts in field_counts.items():
+            self.field_index(field).build(value_counts)
+        self.build_fuzzy_index(global_counts.items())
+
+    # Add the indexes to a snapshot
+    def write_snapshot(self, writer):
+        self.global_index.write_snapshot(writer, 'global.')
+        fields = sorted(self.field_indexes)
+        writer.add_array('fields', 'q', fields)
+        for field in fields:
+            self.field_indexes[field].write_snapshot(writer,
+                                                     'field %d.' % field)
+
+    # Replace the indexes with the ones saved in a snapshot.  The words
+    # used for fuzzy matching aren't saved and are worked out again.
+    def load_snapshot(self, snapshot):
+        self.global_index.load_snapshot(snapshot, 'global.')
+        self.field_indexes = {}
+        for field in snapshot.array('fields', 'q'):
+            self.field_index(field).load_snapshot(snapshot,
+                                                  'field %d.' % field)
+        self.build_fuzzy_index(zip(self.global_index.vocabulary,
+                                   self.global_index.counts))
+
+    # Count the words of (value, count) pairs for fuzzy matching
+    def build_fuzzy_index(self, value_counts):
+        if self.fuzzy_index is None:
+            return
+        self.fuzzy_index = SymSpellIndex(self.fuzzy_index.max_distance,
+                                         self.fuzzy_index.prefix_length,
+                                         self.fuzzy_index.step_size)
+        for value, count in value_counts:
+            if value and count > 0:
+                self.add_words(value, count)
+
+    # Change the counts of the words in a value
+    def add_words(self, value, delta):
+        self.alternatives_cache.clear()
+        for word in set(value.split()):
+            self.fuzzy_index.add(word, delta)
+
+    # Return the index for a field, creating it if needed
+    def field_index(self, field):
+        index = self.field_indexes.get(field)
+        if index is None:
+            index = SuggestionIndex()
+            self.field_indexes[field] = index
+        return index
+
+    # Apply the changes made when the values of a record are overwritten.
+    # old_values holds the values that were replaced, new_values holds the
+    # values that replaced them.  Both are indexed by attribute number.
+    def update(self, old_values, new_values):
+        for field, (old_value, new_value) in enumerate(zip(old_values,
+                                                           new_values)):
+            self.update_field(field, old_value, new_value)
+
+    # Apply the change when one attribute is overwritten
+    def update_field(self, field, old_value, new_value):
+        if old_value == new_value:
+            return
+        if old_value:
+            if self.fuzzy_index is not None and \
+                    self.global_index.count(old_value) > 0:
+                self.add_words(old_value, -1)
+            self.global_index.add(old_value, -1)
+            self.field_index(field).add(old_value, -1)
+        if new_value:
+            if self.fuzzy_index is not None:
+                self.add_words(new_value, 1)
+            self.global_index.add(new_value, 1)
+            self.field_index(field).add(new_value, 1)
+
+    # Return up to limit of the most common values containing all the words.
+    # If a field is given, values are ranked the way chosen for that field.
+    # With fuzzy matching any remaining places are filled with values that
+    # contain words close to the typed ones, closest first.
+    def search(self, words, limit=3, field=None):
+        return run_steps(self.search_steps(words, limit, field))
+
+    # The same search, written as steps that can be run a slice at a time.
+    # The values found are added to results, which may already hold some
+    # values that are to come first, and the values found so far are yielded
+    # before each fuzzy search.
+    def search_steps(self, words, limit=3, field=None, results=None):
+        if results is None:
+            results = []
+        yield from self.add_exact_steps(words, limit, field, results)
+        if self.fuzzy_index is None or len(results) == limit or \
+                len(words) == 0:
+            return results
+        yield list(results)
+
+        # Try the combinations of alternative words with the smallest total
+        # edit distance.  The words typed exactly, at a distance of zero,
+        # have already been tried.
+        alternatives = []
+        for word in words:
+            word_alternatives = yield from self.word_alternatives_steps(word)
+            alternatives.append(word_alternatives)
+        combinations = itertools.islice(closest_combinations(alternatives),
+                                        1, self.fuzzy_searches + 1)
+
+        for _distance, fuzzy_words in combinations:
+            yield None
+            found = len(results)
+            yield from self.add_exact_steps(fuzzy_words, limit, field,
+                                            results)
+            if len(results) == limit:
+                break
+            if len(results) > found:
+                yield list(results)
+        return results
+
+    # Return the word itself and the closest words to it as (word, distance)
+    # pairs
+    def word_alternatives_steps(self, word):
+        alternatives = self.alternatives_cache.get(word)
+        if alternatives is not None:
+            return alternatives
+        alternatives = [(word, 0)]
+        if len(word) < self.fuzzy_minimum_length:
+            return alternatives
+        max_distance = 1 if len(word) <= self.short_word_length else None
+        matches = yield from self.fuzzy_index.lookup_steps(word, max_distance)
+        for candidate, distance in matches:
+            if candidate != word:
+                alternatives.append((candidate, distance))
+                if len(alternatives) > self.fuzzy_alternatives:
+                    break
+        if len(self.alternatives_cache) >= self.alternatives_cache_size:
+            self.alternatives_cache.clear()
+        self.alternatives_cache[word] = alternatives
+        return alternatives
+
+    # Add values containing all the words exactly to results until there are
+    # limit of them
+    def add_exact_steps(self, words, limit, field, results):
+        ranking = self.field_ranking.get(field, self.default_ranking)
+        if field is None or ranking == GLOBAL_RANKING:
+            add_new(results, (yield from self.global_index.search_steps(
+                words, limit + len(results))), limit)
+            return
+
+        if field in self.field_indexes:
+            add_new(results, (yield from self.field_indexes[field].
+                              search_steps(words, limit + len(results))),
+                    limit)
+        if ranking == FIELD_ONLY_RANKING or len(results) == limit:
+            return
+
+        # Fill the remaining places with values from other fields.  Enough
+        # are fetched to make up for any that are already in the results.
+        add_new(results, (yield from self.global_index.search_steps(
+            words, limit + len(results))), limit)
+
+
+# Generate the combinations of one alternative for each word, each list of
+# alternatives being (word, distance) pairs, in order of total distance and
+# then of the words.  Only the combinations that are used are made, so
+# taking the first few is quick however many words there are.  Each is
+# followed in order by the combinations that move one word on to its next
+# alternative, so a heap of those gives them in order.
+def closest_combinations(alternatives):
+    alternatives = [sorted(word_alternatives,
+                           key=lambda pair: (pair[1], pair[0]))
+                    for word_alternatives in alternatives]
+
+    def entry(positions):
+        pairs = [word_alternatives[position] for word_alternatives, position
+                 in zip(alternatives, positions)]
+        return (sum(pair[1] for pair in pairs),
+                [pair[0] for pair in pairs],
+                positions)
+
+    first = tuple([0] * len(alternatives))
+    heap = [entry(first)]
+    seen = set([first])
+    while heap:
+        distance, words, positions = heapq.heappop(heap)
+        yield distance, words
+        for i in range(0, len(positions)):
+            if positions[i] + 1 < len(alternatives[i]):
+                following = positions[0:i] + (positions[i] + 1,) + \
+                    positions[i + 1:]
+                if following not in seen:
+                    seen.add(following)
+                    heapq.heappush(heap, entry(following))
+
+
+# Add the values that aren't already in results until there are limit
+def add_new(results, values, limit):
+    for value in values:
+        if len(results) == limit:
+            break
+        if value not in results:
+            results.append(value)
+
+
+# Counts how often the values of different fields appear in the same record,
+# so the values already entered in a record can be used to suggest the
+# values of the others.  Each (field, value) pair is given an id, and for
+# every pair that has been seen in a record, which is called a context, a
+# sparse table counts the values each other field held in the same records.
+# Only pairs that have actually been seen together take up any space.
+#
+# A value is scored by adding up, over the contexts in the current record,
+# the fraction of records with that context that held the value.  A value
+# seen alongside a context fewer than minimum_count times isn't offered.
+# Contexts that have been seen with a great many different values, such as
+# a field that nearly always holds the same thing, say little about the
+# field being entered and are skipped once max_candidates values have been
+# scored, so a search takes a bounded amount of time.
+#
+# The tables are dictionaries while they are counted from the database,
+# which costs far more than the counts themselves.  A snapshot stores them
+# as flat arrays, and a model loaded from one only turns a table back into
+# a dictionary when its counts change.
+class CooccurrenceModel:
+    def __init__(self, minimum_count=2, max_candidates=20000):
+        self.minimum_count = minimum_count
+        self.max_candidates = max_candidates
+        self.ids = {}
+        self.keys = []
+
+        # The number of records each (field, value) id appears in, and the
+        # count tables keyed by (context id, field)
+        self.totals = []
+        self.tables = {}
+
+    # Count the values of every record in the RESULTS table.  Records are
+    # counted as they are read, so only one is held at a time.
+    def load(self, db_connection):
+        cursor = db_connection.execute('''SELECT FILE_NAME, ATTRIBUTE_NUMBER,
+                                       ATTRIBUTE from RESULTS
+                                       ORDER BY FILE_NAME''')
+        self.build(dict((attribute_number, attribute)
+                        for _name, attribute_number, attribute in attributes)
+                   for _file_name, attributes in itertools.groupby(
+                       cursor, key=operator.itemgetter(0)))
+
+    # Build the tables from records, each a dictionary of values keyed by
+    # attribute number
+    def build(self, records):
+        self.ids = {}
+        self.keys = []
+        self.totals = []
+        self.tables = {}
+        for record in records:
+            self.add_record(record.items(), 1)
+
+    # Add the tables to a snapshot.  The count tables are written one after
+    # another in order of context and field.
+    def write_snapshot(self, writer):
+        writer.add_array('cooccurrence.fields', 'q',
+                         [key[0] for key in self.keys])
+        writer.add_strings('cooccurrence.values',
+                           [key[1] for key in self.keys])
+        writer.add_array('cooccurrence.totals', 'q', self.totals)
+        table_keys = sorted(self.tables)
+        offsets = [0]
+        for table_key in table_keys:
+            offsets.append(offsets[-1] + len(self.tables[table_key]))
+        writer.add_array('cooccurrence.contexts', 'q',
+                         [table_key[0] for table_key in table_keys])
+        writer.add_array('cooccurrence.table_fields', 'q',
+                         [table_key[1] for table_key in table_keys])
+        writer.add_array('cooccurrence.offsets', 'q', offsets)
+        writer.add_array('cooccurrence.targets', 'q',
+                         itertools.chain.from_iterable(
+                             self.tables[table_key].keys()
+                             for table_key in table_keys))
+        writer.add_array('cooccurrence.counts', 'q',
+                         itertools.chain.from_iterable(
+                             self.tables[table_key].values()
+                             for table_key in table_keys))
+
+    # Replace the tables with the ones saved in a snapshot
+    def load_snapshot(self, snapshot):
+        self.keys = list(zip(snapshot.array('cooccurrence.fields', 'q'),
+                             snapshot.strings('cooccurrence.values')))
+        self.ids = dict(zip(self.keys, itertools.count()))
+        self.totals = snapshot.copy_array('cooccurrence.totals', 'q')
+        self.tables = SnapshotTables(
+            snapshot.array('cooccurrence.contexts', 'q'),
+            snapshot.array('cooccurrence.table_fields', 'q'),
+            snapshot.array('cooccurrence.offsets', 'q'),
+            snapshot.array('cooccurrence.targets', 'q'),
+            snapshot.array('cooccurrence.counts', 'q'))
+
+    # Return the id of a (field, value) pair, giving it one if it is new
+    def key_id(self, field, value):
+        key = (field, value)
+        key_id = self.ids.get(key)
+        if key_id is None:
+            key_id = len(self.keys)
+            self.ids[key] = key_id
+            self.keys.append(key)
+            self.totals.append(0)
+        return key_id
+
+    # Change the counts of every pair of values in a record by delta.
+    # field_values is a sequence of (field, value) pairs.
+    def add_record(self, field_values, delta):
+        key_ids = [self.key_id(field, value)
+                   for field, value in field_values if value]
+        for context_id in key_ids:
+            self.totals[context_id] = max(self.totals[context_id] + delta, 0)
+            for target_id in key_ids:
+                if target_id == context_id:
+                    continue
+                target_field = self.keys[target_id][0]
+                table = self.tables.setdefault((context_id, target_field), {})
+                count = table.get(target_id, 0) + delta
+                if count > 0:
+                    table[target_id] = count
+                else:
+                    table.pop(target_id, None)
+                    if len(table) == 0:
+                        del self.tables[(context_id, target_field)]
+
+    # Replace the counts of a record's old values with its new ones.  Both
+    # lists are indexed by attribute number.
+    def update(self, old_values, new_values):
+        if list(old_values) == list(new_values):
+            return
+        if any(old_values):
+            self.add_record(enumerate(old_values), -1)
+        self.add_record(enumerate(new_values), 1)
+
+    # Return up to limit values for a field that contain all the words, best
+    # first, given the values of the other fields of the record indexed by
+    # attribute number
+    def search(self, words, limit, field, record_values):
+        return run_steps(self.search_steps(words, limit, field,
+                                           record_values))
+
+    # The same search, written as steps that can be run a slice at a time
+    def search_steps(self, words, limit, field, record_values):
+        tables = []
+        for context_field, value in enumerate(record_values):
+            if context_field == field or not value:
+                continue
+            context_id = self.ids.get((context_field, value))
+            if context_id is None:
+                continue
+            table = self.tables.get((context_id, field))
+            if table is not None and self.totals[context_id] > 0:
+                tables.append((len(table), self.totals[context_id], table))
+        tables.sort(key=lambda entry: entry[0])
+
+        scores = defaultdict(float)
+        counts = defaultdict(int)
+        scored = 0
+        for size, total, table in tables:
+            if scored > 0 and scored + size > self.max_candidates:
+                break
+            scored += size
+
+            # The counts can change while the search is paused, so it works
+            # through a copy of the table
+            for chunk in chunks(list(table.items())):
+                for target_id, count in chunk:
+                    scores[target_id] += count / total
+                    counts[target_id] += count
+                yield None
+
+        candidates = []
+        items = iter(scores.items())
+        for _start in range(0, len(scores), STEP_SIZE):
+            for target_id, score in itertools.islice(items, STEP_SIZE):
+                value = self.keys[target_id][1]
+                if counts[target_id] >= self.minimum_count and \
+                        all(word in value for word in words):
+                    candidates.append((-score, value))
+            yield None
+        return [value for _score, value in heapq.nsmallest(limit,
+                                                           candidates)]
+
+
+# A count table of a CooccurrenceModel as it is in a snapshot
+class SnapshotTable:
+    def __init__(self, targets, counts):
+        self.targets = targets
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.targets)
+
+    def keys(self):
+        return iter(self.targets)
+
+    def values(self):
+        return iter(self.counts)
+
+    def items(self):
+        return zip(self.targets, self.counts)
+
+
+# The count tables of a CooccurrenceModel loaded from a snapshot.  Tables
+# are found by binary search of the contexts and fields in the snapshot, and
+# a table is only copied into a dictionary when its counts change.
+class SnapshotTables:
+    def __init__(self, contexts, fields, offsets, targets, counts):
+        self.contexts = contexts
+        self.fields = fields
+        self.offsets = offsets
+        self.targets = targets
+        self.counts = counts
+        self.changed = {}
+        self.deleted = set()
+
+    def __iter__(self):
+        for i in range(0, len(self.contexts)):
+            table_key = (self.contexts[i], self.fields[i])
+            if table_key not in self.changed and \
+                    table_key not in self.deleted:
+                yield table_key
+        yield from self.changed
+
+    def __getitem__(self, table_key):
+        table = self.get(table_key)
+        if table is None:
+            raise KeyError(table_key)
+        return table
+
+    def __delitem__(self, table_key):
+        self.changed.pop(table_key, None)
+        self.deleted.add(table_key)
+
+    # Return the position of a table in the snapshot, or None if it isn't
+    # there
+    def position(self, table_key):
+        low = 0
+        high = len(self.contexts)
+        while low < high:
+            middle = (low + high) // 2
+            if (self.contexts[middle], self.fields[middle]) < table_key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.contexts) and \
+                (self.contexts[low], self.fields[low]) == table_key:
+            return low
+        return None
+
+    def get(self, table_key, default=None):
+        table = self.changed.get(table_key)
+        if table is not None:
+            return table
+        if table_key in self.deleted:
+            return default
+        position = self.position(table_key)
+        if position is None:
+            return default
+        start = self.offsets[position]
+        end = self.offsets[position + 1]
+        return SnapshotTable(self.targets[start:end], self.counts[start:end])
+
+    # Return a table that can be changed, copying it out of the snapshot the
+    # first time
+    def setdefault(self, table_key, default):
+        table = self.changed.get(table_key)
+        if table is None:
+            table = self.get(table_key)
+            table = default if table is None else dict(table.items())
+            self.changed[table_key] = table
+            self.deleted.discard(table_key)
+        return table
+
+
+# The interface between the data entry window and the suggestion logic.  It
+# takes the text typed into an entry box and returns the suggestions to show,
+# and is told when a record is saved so the suggestions can learn from it.
+# Nothing here depends on tkinter, so it can be used and measured without a
+# display.
+#
+# When the values of the other fields of the record are given, values that
+# have appeared alongside them in earlier records are suggested first, and
+# the remaining places are filled with the most common values.
+class SuggestionEngine:
+    def __init__(self, limit=3, default_ranking=FIELD_RANKING, fuzzy=False,
+                 conditional=True):
+        self.limit = limit
+        self.frequency_model = FrequencyModel(default_ranking, fuzzy)
+        self.cooccurrence_model = CooccurrenceModel() if conditional \
+            else None
+
+    # Learn the attribute values already in the RESULTS table
+    def load(self, db_connection):
+        self.frequency_model.load(db_connection)
+        if self.cooccurrence_model is not None:
+            self.cooccurrence_model.load(db_connection)
+
+    # Save what has been learnt to a snapshot file along with the identity
+    # and change counter of the database it was learnt from.  Returns False
+    # if the file couldn't be replaced.
+    def write_snapshot(self, file_name, identity, version):
+        writer = SnapshotWriter()
+        self.frequency_model.write_snapshot(writer)
+        if self.cooccurrence_model is not None:
+            self.cooccurrence_model.write_snapshot(writer)
+        return writer.write(file_name, identity, version)
+
+    # Load what has been learnt from a snapshot file instead of the database.
+    # Returns False if there is no snapshot or the database has changed
+    # since it was made.
+    def load_snapshot(self, file_name, identity, version):
+        snapshot = open_snapshot(file_name, identity, version)
+        if snapshot is None:
+            return False
+        if self.cooccurrence_model is not None and \
+                'cooccurrence.totals' not in snapshot:
+            return False
+        self.frequency_model.load_snapshot(snapshot)
+        if self.cooccurrence_model is not None:
+            self.cooccurrence_model.load_snapshot(snapshot)
+        return True
+
+    # Learn attribute values from (attribute number, value, count) rows
+    def build(self, field_value_counts):
+        self.frequency_model.build(field_value_counts)
+
+    # Choose how suggestions are ranked for a particular field
+    def set_ranking(self, field, ranking):
+        self.frequency_model.set_ranking(field, ranking)
+
+    # Learn records from dictionaries of values keyed by attribute number
+    def build_records(self, records):
+        if self.cooccurrence_model is not None:
+            self.cooccurrence_model.build(records)
+
+    # Return the suggestions for the text typed into a field.  The text is
+    # split into words at spaces and a suggestion must contain every word.
+    # record_values holds the values of the record's fields, indexed by
+    # attribute number.
+    def suggest(self, text, field=None, record_values=None):
+        return run_steps(self.suggest_steps(text, field, record_values))
+
+    # The same, written as steps that can be run a slice at a time on the Tk
+    # event loop.  See stepwise.py.
+    def suggest_steps(self, text, field=None, record_values=None):
+        words = text.split()
+        results = []
+        if self.cooccurrence_model is not None and field is not None and \
+                record_values:
+            results = yield from self.cooccurrence_model.search_steps(
+                words, self.limit, field, record_values)
+            if len(results) == self.limit:
+                return results
+            if results:
+                yield list(results)
+        return (yield from self.frequency_model.search_steps(
+            words, self.limit, field, results))
+
+    # Learn from a saved record.  old_values holds the values that were
+    # replaced and new_values the values that replaced them, both indexed by
+    # attribute number.
+    def record_saved(self, old_values, new_values):
+        self.frequency_model.update(old_values, new_values)
+        if self.cooccurrence_model is not None:
+            self.cooccurrence_model.update(old_values, new_values)
+
+    # Learn from a single attribute that was changed, for example by another
+    # operator.  The rest of the record isn't known, so the values it appears
+    # alongside are only learnt the next time the program starts.
+    def attribute_changed(self, field, old_value, new_value):
+        self.frequency_model.update_field(field, old_value, new_value)
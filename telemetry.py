@@ -0,0 +1,176 @@
+import cProfile
+import functools
+import io
+import logging
+import logging.handlers
+import pstats
+import time
+
+
+# Counts how long something takes in buckets of microseconds.  Each doubling
+# of time is split into four buckets, so the buckets are never more than 25%
+# wide and a histogram uses the same small amount of memory no matter how
+# many times it is updated.
+class Histogram:
+    def __init__(self, number_of_buckets=100):
+        self.buckets = [0] * number_of_buckets
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, seconds):
+        bucket = min(self.bucket(int(seconds * 1000000)),
+                     len(self.buckets) - 1)
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+    # Return the bucket a number of microseconds is counted in
+    @staticmethod
+    def bucket(microseconds):
+        if microseconds < 8:
+            return microseconds
+        shift = microseconds.bit_length() - 3
+        return (shift << 2) + (microseconds >> shift)
+
+    # Return the number of microseconds at the top of a bucket
+    @staticmethod
+    def bucket_limit(bucket):
+        if bucket < 8:
+            return bucket + 1
+        return ((bucket & 3) + 5) << ((bucket >> 2) - 1)
+
+    # Return an upper bound on the time taken by a fraction of the calls,
+    # e.g. 0.95 for the 95th percentile
+    def percentile(self, fraction):
+        if self.count == 0:
+            return 0.0
+        wanted = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= wanted:
+                return min(self.bucket_limit(bucket) / 1000000, self.maximum)
+        return self.maximum
+
+    def summary(self):
+        mean = self.total / self.count if self.count else 0.0
+        return '%6d calls  mean %8.2f  p50 %8.2f  p95 %8.2f  ' \
+               'p99 %8.2f  max %8.2f ms' % \
+               (self.count, mean * 1000,
+                self.percentile(0.50) * 1000,
+                self.percentile(0.95) * 1000,
+                self.percentile(0.99) * 1000,
+                self.maximum * 1000)
+
+
+# A timer that does nothing, used when telemetry is turned off
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, trace):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+# Times a block of code and adds the result to a histogram
+class Timer:
+    def __init__(self, telemetry, name):
+        self.telemetry = telemetry
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exception_type, exception, trace):
+        self.telemetry.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+# Records how long the parts of the program that run on every keystroke or
+# record change take.  When it is turned off timing a block costs a single
+# attribute check.  Summaries are written to a log file that is rotated when
+# it gets big, and the profiler can be turned on and off while the program
+# runs.
+class Telemetry:
+    def __init__(self, enabled=False, log_file_name=None,
+                 profile_file_name='soylentOCR.prof'):
+        self.enabled = enabled
+        self.histograms = {}
+        self.profiler = None
+        self.profile_file_name = profile_file_name
+
+        self.logger = None
+        if log_file_name is not None:
+            self.logger = logging.getLogger('soylentOCR.telemetry')
+            self.logger.setLevel(logging.INFO)
+            self.logger.propagate = False
+            handler = logging.handlers.RotatingFileHandler(
+                log_file_name, maxBytes=1024 * 1024, backupCount=3)
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            self.logger.addHandler(handler)
+
+    # Return a context manager that times the block it wraps
+    def timer(self, name):
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, name)
+
+    def record(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = Histogram()
+            self.histograms[name] = histogram
+        histogram.add(seconds)
+
+    # Return a line for each histogram
+    def report(self):
+        return ['%-24s %s' % (name, self.histograms[name].summary())
+                for name in sorted(self.histograms)]
+
+    # Write the histograms, and any extra lines, to the log file
+    def write_report(self, extra_lines=()):
+        if self.logger is None:
+            return
+        for line in self.report() + list(extra_lines):
+            self.logger.info(line)
+
+    # Turn the profiler on, or off if it is on.  When it is turned off the
+    # results are saved to a file and the slowest functions are logged.
+    # Returns a message saying what was done.
+    def toggle_profiler(self):
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+            return 'Profiling'
+
+        self.profiler.disable()
+        self.profiler.dump_stats(self.profile_file_name)
+        output = io.StringIO()
+        pstats.Stats(self.profiler, stream=output).\
+            sort_stats('cumulative').print_stats(15)
+        self.profiler = None
+        if self.logger is not None:
+            self.logger.info(output.getvalue())
+        return 'Profile saved to ' + self.profile_file_name
+
+
+# Decorate a method of an object with a telemetry attribute so that every
+# call to it is timed
+def timed(name):
+    def decorate(method):
+        @functools.wraps(method)
+        def timed_method(self, *args, **kwargs):
+            if not self.telemetry.enabled:
+                return method(self, *args, **kwargs)
+            with Timer(self.telemetry, name):
+                return method(self, *args, **kwargs)
+        return timed_method
+    return decorate
@@ -0,0 +1,98 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from index_snapshot import SnapshotWriter, open_snapshot
+from suggestions import SuggestionIndex
+
+
+# The words the random values are made from.  They share letters so that
+# most grams appear in many values.
+WORDS = ['ab', 'abc', 'bca', 'cab', 'aa', 'b', 'abab', 'cc', 'bac', 'ca']
+
+
+def random_value(generator):
+    return ' '.join(generator.choice(WORDS)
+                    for _word in range(0, generator.randint(1, 3)))
+
+
+def random_query(generator):
+    text = random_value(generator)
+    start = generator.randint(0, len(text) - 1)
+    return text[start:start + generator.randint(1, 6)].split()
+
+
+# Return what a search should find by testing every value the slow way.
+# counts is a dictionary of value to count.
+def brute_force(counts, words, limit):
+    matches = [value for value, count in counts.items()
+               if count > 0 and all(word in value for word in words)]
+    matches.sort(key=lambda value: (-counts[value], value))
+    return matches[0:limit]
+
+
+# The index must give exactly the same results as checking every suggestion
+# with all(word in suggestion for word in words)
+class SuggestionIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.generator = random.Random(1)
+        self.counts = {}
+        for _value in range(0, 300):
+            value = random_value(self.generator)
+            self.counts[value] = self.counts.get(value, 0) + \
+                self.generator.randint(1, 20)
+        self.index = SuggestionIndex()
+        self.index.build(self.counts.items())
+
+    def check_queries(self, index, number_of_queries=1500):
+        for _query in range(0, number_of_queries):
+            words = random_query(self.generator)
+            limit = self.generator.randint(1, 5)
+            self.assertEqual(index.search(words, limit),
+                             brute_force(self.counts, words, limit),
+                             words)
+
+    def update(self, number_of_updates=500):
+        for _update in range(0, number_of_updates):
+            if self.generator.random() < 0.3:
+                value = random_value(self.generator)
+            else:
+                value = self.generator.choice(sorted(self.counts))
+            delta = self.generator.randint(-5, 5)
+            self.index.add(value, delta)
+            if value in self.counts or delta > 0:
+                self.counts[value] = max(self.counts.get(value, 0) + delta,
+                                         0)
+
+    def test_build(self):
+        self.check_queries(self.index)
+
+    def test_updates(self):
+        self.update()
+        self.check_queries(self.index)
+
+    def test_snapshot(self):
+        self.update()
+        directory = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(directory, 'test.snapshot')
+            writer = SnapshotWriter()
+            self.index.write_snapshot(writer, 'test.')
+            writer.write(file_name, 'identity', 1)
+
+            loaded = SuggestionIndex()
+            snapshot = open_snapshot(file_name, 'identity', 1)
+            loaded.load_snapshot(snapshot, 'test.')
+            self.check_queries(loaded)
+
+            # A loaded index carries on learning the same way
+            self.index = loaded
+            self.update()
+            self.check_queries(loaded)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
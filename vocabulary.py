@@ -0,0 +1,116 @@
+import array
+import zlib
+
+
+# The values of a suggestion index kept compactly.  A list of str objects
+# and a dictionary to look them up cost well over a hundred bytes a value,
+# so instead the UTF-8 text of every value is stored one after another in a
+# single buffer along with an array of where each one starts.  Values are
+# found with an open addressing hash table held in an array of ids.  It is
+# hashed with crc32 rather than hash(), which changes from one process to
+# the next, so the table can be saved in a snapshot as it is.
+#
+# A value's id is the order it was added in.  Searches test the bytes where
+# they are, and a value is only turned back into a string when it is going
+# to be shown.  UTF-8 keeps the order of the characters, so the bytes of two
+# values compare the same way as the strings, and a word is in a value if
+# and only if its bytes are in the value's bytes.
+class Vocabulary:
+    def __init__(self):
+        self.text = bytearray()
+        self.offsets = array.array('q', [0])
+        self.slots = array.array('q', [-1]) * 8
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    # Return a value as a string
+    def __getitem__(self, value_id):
+        return self.text[self.offsets[value_id]:
+                         self.offsets[value_id + 1]].decode('utf-8')
+
+    def __iter__(self):
+        for value_id in range(0, len(self)):
+            yield self[value_id]
+
+    # Return the UTF-8 bytes of a value, for sorting
+    def key(self, value_id):
+        return self.text[self.offsets[value_id]:self.offsets[value_id + 1]]
+
+    # Return True if a value contains all of a list of words, each given as
+    # UTF-8 bytes
+    def contains_all(self, value_id, words):
+        start = self.offsets[value_id]
+        end = self.offsets[value_id + 1]
+        for word in words:
+            if self.text.find(word, start, end) < 0:
+                return False
+        return True
+
+    # Return the slot of the hash table that holds a value, or the empty
+    # slot it would go in
+    def slot(self, encoded):
+        mask = len(self.slots) - 1
+        slot = zlib.crc32(encoded) & mask
+        while True:
+            value_id = self.slots[slot]
+            if value_id < 0:
+                return slot
+            start = self.offsets[value_id]
+            end = self.offsets[value_id + 1]
+            if end - start == len(encoded) and \
+                    self.text[start:end] == encoded:
+                return slot
+            slot = (slot + 1) & mask
+
+    # Return the id of a value, or None if it hasn't been added
+    def find(self, value):
+        value_id = self.slots[self.slot(value.encode('utf-8'))]
+        if value_id < 0:
+            return None
+        return value_id
+
+    # Return the id of a value, adding it if it is new
+    def add(self, value):
+        encoded = value.encode('utf-8')
+        slot = self.slot(encoded)
+        value_id = self.slots[slot]
+        if value_id >= 0:
+            return value_id
+        value_id = len(self)
+        self.text.extend(encoded)
+        self.offsets.append(len(self.text))
+        self.slots[slot] = value_id
+
+        # Keep the table no more than half full so probes stay short
+        if 2 * len(self) > len(self.slots):
+            self.resize(2 * len(self.slots))
+        return value_id
+
+    # Rebuild the hash table with a number of slots, which must be a power
+    # of two
+    def resize(self, size):
+        self.slots = array.array('q', [-1]) * size
+        mask = size - 1
+        view = memoryview(self.text)
+        for value_id in range(0, len(self)):
+            slot = zlib.crc32(view[self.offsets[value_id]:
+                                   self.offsets[value_id + 1]]) & mask
+            while self.slots[slot] >= 0:
+                slot = (slot + 1) & mask
+            self.slots[slot] = value_id
+        view.release()
+
+    # Add the vocabulary to a snapshot.  The names of its sections start
+    # with prefix.
+    def write_snapshot(self, writer, prefix):
+        writer.add(prefix + 'text', bytes(self.text))
+        writer.add_array(prefix + 'offsets', 'q', self.offsets)
+        writer.add_array(prefix + 'slots', 'q', self.slots)
+
+    # Replace the vocabulary with one saved in a snapshot.  Each part is
+    # copied in one go, so nothing is worked out again.
+    def load_snapshot(self, snapshot, prefix):
+        self.text = bytearray(snapshot.section(prefix + 'text'))
+        self.offsets = snapshot.copy_array(prefix + 'offsets', 'q')
+        self.slots = snapshot.copy_array(prefix + 'slots', 'q')